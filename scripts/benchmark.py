@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro benchmarks for the planners' per-cycle hot spots (no ROS needed).
+
+    python benchmark.py            # run everything
+    python benchmark.py dmin       # run one benchmark
+"""
+import argparse
+import csv
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from scan_processing import window_average, profile_min, cluster_scan, cluster_length
+from potential_field import PotentialField
+from gaps import find_gaps
+from time_logger import TimeLogger
+from stage_timer import StageTimer
+from raycast import MapRaycaster
+from waypoints import load_waypoints
+from speed_profile import load_speed_profile, speed_profile
+
+
+def timeit(func, repeat):
+    func()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - t0) / repeat
+
+
+def synthetic_scan(scan_range, seed=0):
+    rng = np.random.default_rng(seed)
+    angle = np.linspace(-2.35, 2.35, scan_range)
+    scan = np.minimum(1.5 / np.maximum(np.fabs(np.cos(angle)), 1e-3), 10.0)
+    scan += rng.normal(0, 0.01, scan_range)
+    for _ in range(3):
+        s = rng.integers(scan_range // 4, scan_range * 3 // 4)
+        scan[s:s + scan_range // 60] = rng.uniform(1.0, 3.0)
+    return scan
+
+
+def legacy_dmin(scan_filtered, scan_range):
+    # main_drive before window_average(), with the scan end taken from scan_range
+    temp_avg = 0
+    dmin = 0
+    for i in range(10):
+        dmin += scan_filtered[i]
+    dmin /= 10
+
+    i = 0
+    while i < scan_range-7:
+        j = 0
+        while j < 10:
+            if i + j > scan_range-1:
+                temp_avg += 0
+            else:
+                temp_avg += scan_filtered[i+j]
+            j += 1
+        temp_avg /= 10
+        if dmin > temp_avg:
+            if temp_avg == 0:
+                temp_avg = dmin
+            dmin = temp_avg
+        temp_avg = 0
+        i += 3
+    return dmin
+
+
+def bench_dmin(repeat):
+    print("dmin (window=10, stride=3)")
+    print(f"{'beams':>6} {'legacy[us]':>11} {'exact[us]':>10} {'cumsum[us]':>11} {'saved[us]':>10}")
+    for scan_range in (1080, 2160):
+        scan = synthetic_scan(scan_range)
+        scan_list = scan.tolist()
+
+        legacy = legacy_dmin(scan_list, scan_range)
+        assert legacy == profile_min(window_average(scan))
+
+        t_legacy = timeit(lambda: legacy_dmin(scan_list, scan_range), repeat)
+        t_exact = timeit(lambda: profile_min(window_average(scan)), repeat)
+        t_fast = timeit(lambda: profile_min(window_average(scan, exact=False)), repeat)
+        print(f"{scan_range:>6} {t_legacy*1e6:>11.1f} {t_exact*1e6:>10.1f} {t_fast*1e6:>11.1f} {(t_legacy - t_exact)*1e6:>10.1f}")
+
+
+def synthetic_obstacles(count, start, stop, front_idx, seed=0):
+    # sigma in the range define_obstacles() produces for small obstacles
+    rng = np.random.default_rng(seed)
+    center = rng.integers(start, stop, count) - front_idx
+    sigma = rng.uniform(0.05, 0.2, count)
+    a_k = rng.uniform(0.1, 3.0, count)
+    return [[int(c), float(s), float(a)] for c, s, a in zip(center, sigma, a_k)]
+
+
+def legacy_rep_field(obstacles, scan_range, front_idx, interval, start, stop):
+    # local_fgm.rep_field of odg_pf_pp.py before PotentialField
+    f_rep_list = [0]*scan_range
+    for i in range(len(obstacles)):
+        for j in range(start, stop):
+            f_rep_list[j] += obstacles[i][2] * np.exp((-0.5)*((((j-front_idx)*interval - obstacles[i][0]*interval)**2) / (obstacles[i][1])**2))
+    return f_rep_list
+
+
+def bench_rep_field(repeat):
+    scan_range, interval = 1080, 0.00435
+    start, stop = 299, 780
+    field = PotentialField(start, stop)
+    truncated = PotentialField(start, stop, truncate=4)
+    field.configure(scan_range, interval)
+    truncated.configure(scan_range, interval)
+
+    print(f"rep_field (beams {start}..{stop - 1}, truncated at 4 sigma)")
+    print(f"{'obs':>4} {'scalar[us]':>11} {'broadcast[us]':>14} {'truncated[us]':>14} {'speedup':>8} {'err':>9} {'trunc err':>10}")
+    for count in (1, 4, 8, 16):
+        obstacles = synthetic_obstacles(count, start, stop, field.front_idx, seed=count)
+        legacy = np.array(legacy_rep_field(obstacles, scan_range, field.front_idx, interval, start, stop))
+        err = np.max(np.fabs(field.repulsive(obstacles) - legacy))
+        trunc_err = np.max(np.fabs(truncated.repulsive(obstacles) - legacy))
+        assert err < 1e-12
+
+        t_legacy = timeit(lambda: legacy_rep_field(obstacles, scan_range, field.front_idx, interval, start, stop), max(repeat // 20, 1))
+        t_field = timeit(lambda: field.repulsive(obstacles), repeat)
+        t_trunc = timeit(lambda: truncated.repulsive(obstacles), repeat)
+        print(f"{count:>4} {t_legacy*1e6:>11.1f} {t_field*1e6:>14.1f} {t_trunc*1e6:>14.1f} {t_legacy/t_field:>7.0f}x {err:>9.1e} {trunc_err:>10.1e}")
+
+
+def legacy_total_field(obstacles, goal_point, gamma, scan_range, front_idx, interval, start, stop):
+    # rep_field + att_field + total_field of odg_pf_pp.py before PotentialField.solve()
+    f_rep_list = legacy_rep_field(obstacles, scan_range, front_idx, interval, start, stop)
+    f_att_list = []
+    for i in range(scan_range):
+        idx2deg = (-front_idx+i)*interval
+        f_att_list.append(gamma * np.fabs(goal_point[1] - idx2deg))
+    f_total_list = [0]*scan_range
+    for i in range(scan_range):
+        f_total_list[i] = f_rep_list[i] + f_att_list[i]
+    return np.argmin(f_total_list[start:stop])+start
+
+
+def bench_total_field(repeat):
+    scan_range, interval, gamma = 1080, 0.00435, 0.5
+    start, stop = 360, 720
+    field = PotentialField(start, stop)
+    field.configure(scan_range, interval)
+    goal_point = [2.0, 0.1]
+
+    print(f"rep + att + total field (beams {start}..{stop - 1})")
+    print(f"{'obs':>4} {'legacy[us]':>11} {'solve[us]':>10} {'speedup':>8}")
+    for count in (0, 2, 4, 8):
+        obstacles = synthetic_obstacles(count, start, stop, field.front_idx, seed=count)
+        legacy = legacy_total_field(obstacles, goal_point, gamma, scan_range, field.front_idx, interval, start, stop)
+        assert legacy == field.solve(obstacles, goal_point[1], gamma)[0]
+
+        t_legacy = timeit(lambda: legacy_total_field(obstacles, goal_point, gamma, scan_range, field.front_idx, interval, start, stop), max(repeat // 20, 1))
+        t_solve = timeit(lambda: field.solve(obstacles, goal_point[1], gamma), repeat)
+        print(f"{count:>4} {t_legacy*1e6:>11.1f} {t_solve*1e6:>10.1f} {t_legacy/t_solve:>7.0f}x")
+
+
+def legacy_find_gap(scan, threshold, scan_range, gap_size):
+    # FGM.find_gap of fgm_gnu.py before find_gaps()
+    gaps = []
+    i = 0
+    while i < scan_range - gap_size:
+        if scan[i] > threshold:
+            start_idx_temp = i
+            max_temp = scan[i]
+            max_idx_temp = i
+            while ((scan[i] > threshold) and (i+1 < scan_range)):
+                i += 1
+                if scan[i] > max_temp:
+                    max_temp = scan[i]
+                    max_idx_temp = i
+            if scan[i] > threshold:
+                i += 1
+            gaps.append([start_idx_temp, i, max_idx_temp])
+        i += 1
+    return gaps
+
+
+def bench_gaps(repeat):
+    print("find_gap (threshold 3.0)")
+    print(f"{'beams':>6} {'gaps':>5} {'legacy[us]':>11} {'numpy[us]':>10} {'speedup':>8}")
+    for scan_range in (1080, 2160):
+        # find_gap gets scan_filtered as an ndarray since ScanFilter
+        scan = synthetic_scan(scan_range) * 2
+
+        legacy = legacy_find_gap(scan, 3.0, scan_range, 1)
+        gaps = find_gaps(scan, 3.0, 0, scan_range, 1)
+        assert legacy == [list(gap) for gap in gaps[['start', 'end', 'max_idx']].tolist()]
+
+        t_legacy = timeit(lambda: legacy_find_gap(scan, 3.0, scan_range, 1), repeat)
+        t_numpy = timeit(lambda: find_gaps(scan, 3.0, 0, scan_range, 1), repeat)
+        print(f"{scan_range:>6} {len(gaps):>5} {t_legacy*1e6:>11.1f} {t_numpy*1e6:>10.1f} {t_legacy/t_numpy:>7.0f}x")
+
+
+def legacy_obs_dect(scan, scan_range):
+    # Obstacle_detect.obs_dect before cluster_scan(), returns obs
+    scan_obs = []
+    i = 1
+    while scan_range - 1 > i:
+        start_idx_temp = i
+        max_idx_temp = i
+        min_idx_temp = i
+        i = i+1
+        while math.sqrt(math.pow(scan[i]*math.sin(math.radians(0.25)),2) + math.pow(scan[i-1]-scan[i]*math.cos(math.radians(0.25)),2)) < 1.5 + scan[i]*0.00628 and (i+1 < scan_range):
+            if scan[i] > scan[max_idx_temp]:
+                max_idx_temp = i
+            if scan[i] < scan[min_idx_temp]:
+                min_idx_temp = i
+            i = i+1
+        scan_obs.append([start_idx_temp, i-1, max_idx_temp, scan[max_idx_temp], scan[min_idx_temp]])
+        i += 1
+
+    for obs in scan_obs:
+        if not (0 < obs[3] < 4):
+            continue
+        theta = (obs[1] - obs[0])*0.25
+        lengh = math.sqrt(math.pow(scan[obs[1]]*math.sin(math.radians(theta)),2) + math.pow(scan[obs[0]]-scan[obs[1]]*math.cos(math.radians(theta)),2))
+        if lengh < 2 and not (obs[0] > 680 or obs[1] < 400):
+            return True
+    return False
+
+
+def vectorized_obs_dect(scan):
+    clusters = cluster_scan(scan)
+    keep = (clusters['max'] < 4) & (clusters['max'] > 0) & (cluster_length(scan, clusters) < 2)
+    return bool(np.any((clusters['start'][keep] <= 680) & (clusters['end'][keep] >= 400)))
+
+
+def bench_obs_dect(repeat):
+    print("obs_dect (d_group 1.5)")
+    print(f"{'scan':>8} {'obs':>5} {'legacy[us]':>11} {'numpy[us]':>10} {'speedup':>8}")
+    for name, scale in (('open', 2.0), ('blocked', 0.5)):
+        scan = synthetic_scan(1080) * scale
+        obs = legacy_obs_dect(scan, len(scan))
+        assert obs == vectorized_obs_dect(scan)
+
+        t_legacy = timeit(lambda: legacy_obs_dect(scan, len(scan)), max(repeat // 20, 1))
+        t_numpy = timeit(lambda: vectorized_obs_dect(scan), repeat)
+        print(f"{name:>8} {str(obs):>5} {t_legacy*1e6:>11.1f} {t_numpy*1e6:>10.1f} {t_legacy/t_numpy:>7.0f}x")
+
+
+def per_call(func, repeat):
+    t = np.empty(repeat)
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(i)
+        t[i] = time.perf_counter() - t0
+    return t
+
+
+def bench_time_log(repeat):
+    print("time data logging, per call on the control thread")
+    print(f"{'writer':>8} {'mean[us]':>9} {'p99[us]':>8} {'max[us]':>8}")
+    repeat = repeat * 50
+    with tempfile.TemporaryDirectory() as tmp:
+        f = open(os.path.join(tmp, "csv.csv"), "w", newline="")
+        writer = csv.writer(f)
+        t_csv = per_call(lambda i: writer.writerow([i, i*0.01, 0.002, "gp", 3.0, 0.1, 1.0, 2.0, 0.5]), repeat)
+        f.close()
+
+        logger = TimeLogger(os.path.join(tmp, "ring.rec"), capacity=repeat)
+        t_ring = per_call(lambda i: logger.log(i, i*0.01, 0.002, "gp", 3.0, 0.1, (1.0, 2.0, 0.5)), repeat)
+        logger.close()
+
+        for name, t in (('csv', t_csv), ('ring', t_ring)):
+            print(f"{name:>8} {t.mean()*1e6:>9.2f} {np.percentile(t, 99)*1e6:>8.2f} {t.max()*1e6:>8.1f}")
+
+
+def bench_stage_timer(repeat):
+    print("stage timer, cost of one lap()")
+    print(f"{'timer':>8} {'lap[ns]':>8}")
+    repeat = repeat * 500
+    for name, enabled in (('on', True), ('off', False)):
+        timer = StageTimer(('stage',), enabled=enabled)
+        t0 = time.perf_counter()
+        t = timer.now()
+        for _ in range(repeat):
+            t = timer.lap('stage', t)
+        print(f"{name:>8} {(time.perf_counter() - t0)/repeat*1e9:>8.0f}")
+
+
+def loop_max(scan, start, stop, step):
+    # the per-beam max search of for_find_gap()
+    max_idx, max_temp = start, scan[start]
+    for i in range(start, stop, step):
+        if max_temp < scan[i]:
+            max_temp = scan[i]
+            max_idx = i
+    return max_idx
+
+
+def bench_degraded(repeat):
+    scan_range, interval, gamma = 1080, 0.00435, 0.5
+    front_idx = scan_range // 2
+    fov, step = int((math.pi/6)/interval), 2
+    scan = synthetic_scan(scan_range) * 2
+    field = PotentialField(360, 720)
+    degraded = PotentialField(max(front_idx - fov, 360), min(front_idx + fov, 720), step=step)
+    field.configure(scan_range, interval)
+    degraded.configure(scan_range, interval)
+    obstacles = synthetic_obstacles(4, 360, 720, front_idx, seed=4)
+
+    print(f"degraded mode (+-{fov} beams, beam step {step})")
+    print(f"{'kernel':>12} {'normal[us]':>11} {'degraded[us]':>13} {'speedup':>8}")
+    for name, normal, fast in (
+            ('find_gaps', lambda: find_gaps(scan, 3.0, 0, scan_range, 1),
+             lambda: find_gaps(scan, 3.0, front_idx - fov, front_idx + fov, 1, step)),
+            ('for_gap loop', lambda: loop_max(scan, front_idx - 240, front_idx + 240, 1),
+             lambda: loop_max(scan, front_idx - 240, front_idx + 240, step)),
+            ('field.solve', lambda: field.solve(obstacles, 0.1, gamma), lambda: degraded.solve(obstacles, 0.1, gamma))):
+        t_normal = timeit(normal, repeat)
+        t_fast = timeit(fast, repeat)
+        print(f"{name:>12} {t_normal*1e6:>11.1f} {t_fast*1e6:>13.1f} {t_normal/t_fast:>7.1f}x")
+
+
+def bench_raycast(repeat):
+    map_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map")
+    caster = MapRaycaster(os.path.join(map_dir, "vegas_test.yaml"))
+    waypoints = load_waypoints(os.path.join(map_dir, "wp_vegas_test.csv"))
+    idx = np.linspace(0, len(waypoints) - 1, 1000).astype(np.int64)
+    poses = np.column_stack((waypoints['x'][idx], waypoints['y'][idx], waypoints['heading'][idx]))
+
+    print(f"raycast ({caster.beams} beams, vegas_test, poses along the waypoints)")
+    print(f"{'batch':>6} {'per scan[us]':>13} {'scans/s':>8}")
+    for batch in (1, 10, 100, 1000):
+        t = timeit(lambda: caster.scans(poses[:batch]), max(repeat*10//batch, 1))/batch
+        print(f"{batch:>6} {t*1e6:>13.1f} {1/t:>8.0f}")
+
+
+def bench_speed_profile(repeat):
+    map_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map")
+    csv_path = os.path.join(map_dir, "wp_vegas_test.csv")
+    waypoints = load_waypoints(csv_path)
+    build = timeit(lambda: speed_profile(waypoints, 0.523, 9.81, 20.0, 1.5), max(repeat//50, 1))
+    load_speed_profile(csv_path, 0.523, 9.81, 20.0, 1.5)
+    cached = timeit(lambda: load_speed_profile(csv_path, 0.523, 9.81, 20.0, 1.5), repeat)
+
+    print(f"speed profile ({len(waypoints)} waypoints, vegas_test)")
+    print(f"{'build[ms]':>10} {'cached[us]':>11}")
+    print(f"{build*1e3:>10.1f} {cached*1e6:>11.1f}")
+
+
+BENCHMARKS = {
+    'dmin': bench_dmin,
+    'rep_field': bench_rep_field,
+    'total_field': bench_total_field,
+    'gaps': bench_gaps,
+    'obs_dect': bench_obs_dect,
+    'time_log': bench_time_log,
+    'stage_timer': bench_stage_timer,
+    'degraded': bench_degraded,
+    'raycast': bench_raycast,
+    'speed_profile': bench_speed_profile,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('names', nargs='*', help=', '.join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    for name in args.names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+        BENCHMARKS[name](args.repeat)
+        print()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class CycleBudget:
+    """
+    Per-cycle deadline budget with a degraded fallback mode.
+
+    record(elapsed) counts the cycles that took longer than `budget` seconds.
+    Once `miss_limit` of the last `window` cycles overran, `degraded` turns
+    True and the planner switches to its cheaper path; it turns False again
+    after `recover_cycles` cycles in a row below recover_ratio*budget. Every
+    switch is passed to `log`.
+
+    May be shared by the threads of one pipeline, the counters are then
+    approximate.
+    """
+    def __init__(self, budget, miss_limit=5, window=20, recover_cycles=100, recover_ratio=0.7, log=print, name='cycle'):
+        self.budget = budget
+        self.miss_limit = miss_limit
+        self.recover_cycles = recover_cycles
+        self.recover_below = recover_ratio*budget
+        self.log = log
+        self.name = name
+        self.degraded = False
+
+        self._missed = [0]*window
+        self._missed_sum = 0
+        self._pos = 0
+        self._fast = 0
+
+        self.cycles = 0
+        self.overruns = 0
+        self.worst = 0.0
+        self.degraded_cycles = 0
+        self.switches = 0
+
+    def record(self, elapsed):
+        """:return: degraded, for the next cycle"""
+        self.cycles += 1
+        missed = 1 if elapsed > self.budget else 0
+        if missed:
+            self.overruns += 1
+            if elapsed > self.worst:
+                self.worst = elapsed
+        self._missed_sum += missed - self._missed[self._pos]
+        self._missed[self._pos] = missed
+        self._pos = (self._pos + 1) % len(self._missed)
+
+        if self.degraded:
+            self.degraded_cycles += 1
+            self._fast = self._fast + 1 if elapsed < self.recover_below else 0
+            if self._fast >= self.recover_cycles:
+                self._switch(False, f"{self.recover_cycles} cycles below {self.recover_below*1e3:.1f} ms")
+        elif self._missed_sum >= self.miss_limit:
+            self._switch(True, f"{self._missed_sum} of the last {len(self._missed)} cycles over {self.budget*1e3:.1f} ms")
+        return self.degraded
+
+    def _switch(self, degraded, reason):
+        self.degraded = degraded
+        self.switches += 1
+        self._fast = 0
+        self._missed = [0]*len(self._missed)
+        self._missed_sum = 0
+        self.log(f"{self.name}: {'degraded' if degraded else 'normal'} mode after {reason}")
+
+    def stats(self):
+        return (f"{self.name} budget {self.budget*1e3:.1f} ms: {self.overruns} of {self.cycles} cycles over "
+                f"(worst {self.worst*1e3:.1f} ms), {self.switches} mode switches, {self.degraded_cycles} degraded cycles")
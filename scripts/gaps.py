@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import numpy as np
+
+GAP_DTYPE = np.dtype([
+    ('start', '<i8'),
+    ('end', '<i8'),
+    ('max_idx', '<i8'),
+    ('width', '<i8'),
+    ('depth', '<f8'),
+])
+
+
+class GapIndex:
+    """
+    Lookup over the gaps of one scan (find_gaps() output, sorted by start).
+
+    nearest() bisects the gap boundaries for the gap containing a reference
+    beam or the closest one. best() returns the k best gaps for a score,
+    either a name from SCORES or a callable (gaps, ref_idx) -> array, higher
+    is better and ties keep the lower index.
+    """
+    SCORES = {
+        'width': lambda gaps, ref_idx: gaps['width'],
+        'depth': lambda gaps, ref_idx: gaps['depth'],
+        'distance': lambda gaps, ref_idx: -gap_distance(gaps, ref_idx),
+    }
+
+    def __init__(self, gaps):
+        self.gaps = gaps
+        self.start = gaps['start']
+        self.end = gaps['end']
+
+    def __len__(self):
+        return len(self.gaps)
+
+    def nearest(self, ref_idx):
+        """
+        :return: index of the gap with start <= ref_idx <= end, else of the one
+                 with the smallest distance to ref_idx (left one on a tie), -1 if empty
+        """
+        num = len(self.gaps)
+        if num == 0:
+            return -1
+        k = int(np.searchsorted(self.start, ref_idx, side='right')) - 1
+        if k >= 0 and self.end[k] >= ref_idx:
+            return k
+        if k < 0:
+            return 0
+        if k + 1 < num and self.start[k + 1] - ref_idx < ref_idx - self.end[k]:
+            return k + 1
+        return k
+
+    def best(self, k=1, score='width', ref_idx=0):
+        """
+        :return: indices of the k best gaps, best first
+        """
+        if not callable(score):
+            score = self.SCORES[score]
+        value = np.asarray(score(self.gaps, ref_idx))
+        if k == 1:
+            return np.array([np.argmax(value)]) if len(value) else np.zeros(0, dtype=np.int64)
+        return np.argsort(-value, kind='stable')[:k]
+
+
+def gap_distance(gaps, ref_idx):
+    """Beams between ref_idx and each gap, 0 for the gaps containing it."""
+    return np.maximum(gaps['start'] - ref_idx, 0) + np.maximum(ref_idx - gaps['end'], 0)
+
+
+def find_gaps(scan, threshold, start=0, stop=None, gap_size=1, step=1):
+    """
+    Runs of beams farther than threshold within start .. stop-1.
+
+    step > 1 only looks at every step-th beam of the window; indices and
+    widths stay in beams of the full scan.
+
+    :return: GAP_DTYPE array sorted by start. end is exclusive, max_idx is the
+             first farthest beam of the run and depth its range. gap[0..2] are
+             the [start, end, max_idx] of the old find_gap lists, gap[3] the width.
+             Runs starting at stop - gap_size or later are dropped, as before.
+    """
+    scan = np.asarray(scan, dtype=np.float64)
+    stop = len(scan) if stop is None else min(stop, len(scan))
+    window = scan[start:stop:step]
+
+    free = np.zeros(len(window) + 2, dtype=np.int8)
+    np.greater(window, threshold, out=free[1:-1].view(bool))
+    # edges alternate run start (+1), run end (-1, exclusive)
+    edge = np.diff(free)
+    bounds = np.flatnonzero(edge)
+    if len(bounds) == 0:
+        return np.zeros(0, dtype=GAP_DTYPE)
+    run_start = bounds[0::2]
+    run_end = bounds[1::2]
+
+    # max over [run_start[k], run_end[k]), -inf pads the run ending at the window end
+    padded = np.empty(len(window) + 1)
+    padded[:-1] = window
+    padded[-1] = -np.inf
+    depth = np.maximum.reduceat(padded, bounds)[::2]
+
+    # first beam of each run that reaches its maximum, beams outside the
+    # runs are <= threshold < depth and never match
+    label = np.cumsum(edge[:-1] == 1) - 1
+    hits = np.flatnonzero(window == depth[label])
+    max_idx = hits[np.searchsorted(hits, run_start)]
+
+    if step != 1:
+        run_start = run_start*step
+        run_end = np.minimum(run_end*step, stop - start)
+        max_idx = max_idx*step
+
+    keep = run_start < stop - gap_size - start
+    gaps = np.zeros(np.count_nonzero(keep), dtype=GAP_DTYPE)
+    gaps['start'] = run_start[keep] + start
+    gaps['end'] = run_end[keep] + start
+    gaps['max_idx'] = max_idx[keep] + start
+    gaps['width'] = run_end[keep] - run_start[keep]
+    gaps['depth'] = depth[keep]
+    return gaps
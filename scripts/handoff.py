@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import itertools
+import threading
+import time
+from collections import namedtuple
+
+
+class Mailbox:
+    """
+    Single-slot "latest value wins" handoff between planner threads.
+
+    publish() never blocks: it swaps one (seq, value) tuple into the slot, an
+    atomic reference assignment under the GIL, and counts the previous value
+    as dropped if nobody took it. consume() returns each value at most once
+    and blocks until a newer one arrives or the timeout passes. The Event is
+    only used to wake a sleeping consumer, never to guard the slot.
+
+    Meant for one consumer; several producers are fine (seq comes from one
+    shared counter), the counters are then approximate.
+    """
+    def __init__(self, name=''):
+        self.name = name
+        self._seq = itertools.count(1)
+        self._slot = (0, None)
+        self._ready = threading.Event()
+        self.taken_seq = 0
+
+        self.published = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.timeouts = 0
+
+    def publish(self, value):
+        """:return: sequence number of value"""
+        seq = next(self._seq)
+        if self._slot[0] > self.taken_seq:
+            self.dropped += 1
+        self._slot = (seq, value)
+        self.published += 1
+        self._ready.set()
+        return seq
+
+    def poll(self):
+        """Newest value not taken yet, or None. Never blocks."""
+        seq, value = self._slot
+        if seq <= self.taken_seq:
+            return None
+        self.taken_seq = seq
+        self.consumed += 1
+        return value
+
+    def consume(self, timeout=None):
+        """
+        :param timeout: seconds, None waits forever
+        :return: newest value not taken yet, None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            value = self.poll()
+            if value is not None:
+                return value
+            self._ready.clear()
+            # a publish between poll() and clear() is caught here
+            value = self.poll()
+            if value is not None:
+                return value
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.timeouts += 1
+                return None
+            self._ready.wait(remaining)
+
+    def stats(self):
+        return f"{self.name}: published {self.published}, consumed {self.consumed}, dropped {self.dropped}, timeouts {self.timeouts}"
+
+
+class ScanTrigger:
+    """
+    Runs a control loop on incoming scans instead of a fixed rate.
+
+    The scan callback skips frames for which duplicate(stamp) is True and
+    calls notify() once the new scan is stored. wait() returns True when the
+    step should run: on a new scan, but no more often than `rate`, or after
+    `deadline` seconds without one (the step then runs on the last scan so
+    commands keep following the odometry). It returns False until the first
+    scan arrived, sleeping instead of spinning.
+    """
+    def __init__(self, rate, deadline=0.1):
+        self.period = 1.0/rate
+        self.deadline = deadline
+        self._scans = Mailbox('scan')
+        self._last_stamp = None
+        self._last_step = None
+        self.t_start = None
+
+        self.frames = 0
+        self.duplicates = 0
+        self.steps = 0
+        self.deadline_steps = 0
+
+    def duplicate(self, stamp):
+        """True if stamp is the one of the previous scan (None never is)."""
+        if stamp is not None and stamp == self._last_stamp:
+            self.duplicates += 1
+            return True
+        self._last_stamp = stamp
+        return False
+
+    def notify(self):
+        self.frames += 1
+        self._scans.publish(self.frames)
+
+    def wait(self):
+        if self._last_step is not None:
+            idle = self._last_step + self.period - time.monotonic()
+            if idle > 0:
+                time.sleep(idle)
+
+        if self._scans.consume(timeout=self.deadline) is None:
+            if self.frames == 0:
+                return False
+            self.deadline_steps += 1
+
+        now = time.monotonic()
+        if self.t_start is None:
+            self.t_start = now
+        self._last_step = now
+        self.steps += 1
+        return True
+
+    def saved(self):
+        """Steps a fixed-rate loop would have run since the first scan minus the steps run."""
+        if self.t_start is None:
+            return 0
+        return max(int((time.monotonic() - self.t_start)/self.period) - self.steps, 0)
+
+    def stats(self):
+        return (f"scan trigger: {self.frames} scans, {self.duplicates} duplicates skipped, "
+                f"{self.steps} steps ({self.deadline_steps} on deadline), {self.saved()} cycles saved")
+
+
+# source 'gp' / 'lp', seq the Obstacle_detect loop of the input frame, stamp
+# its time.time(), stamps the ROS stamps for the latency logger
+Command = namedtuple('Command', ('speed', 'steer', 'source', 'seq', 'stamp', 'stamps'))
+
+
+class CommandArbiter:
+    """
+    Takes the place of the main_q Mailbox: keeps the newest Command of every
+    source and decides which one maindrive drives.
+
+    - a command older than max_age seconds (from its input frame) is stale
+      and never driven
+    - while obstacles are present (obstacle(), from Obstacle_detect) a local
+      command of an input since the switch overrides every global one
+    - otherwise the command of the newest input wins
+
+    maindrive calls select() at its own rate, the car then gets the chosen
+    command every tick while it is fresh, whenever the planners finish. Once
+    every command is stale select() returns None and maindrive drives a stop
+    (param stale_stop; without it the car keeps the last command sent).
+    consume() instead waits for a command other than the last one taken,
+    for loops driven by the planners (the offline replay).
+    """
+    def __init__(self, name='main_q', max_age=0.1, clock=time.time):
+        self.name = name
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._latest = {}
+        self._taken = None
+        self.obstacles = False
+        self.obstacle_since = 0
+
+        self.published = 0
+        self.replaced = 0
+        self.driven = 0
+        self.repeated = 0
+        self.stale = 0
+        self.overrides = 0
+        self.switches = 0
+
+    def publish(self, command):
+        """:return: seq of command"""
+        with self._lock:
+            old = self._latest.get(command.source)
+            if old is not None and old is not self._taken:
+                self.replaced += 1
+            self._latest[command.source] = command
+            self.published += 1
+        self._ready.set()
+        return command.seq
+
+    def obstacle(self, present, seq):
+        """Obstacle state as of input frame seq."""
+        with self._lock:
+            if present == self.obstacles:
+                return
+            self.obstacles = present
+            self.obstacle_since = seq
+            self.switches += 1
+
+    def _pick(self):
+        """:return: (Command to drive or None, whether it overrides a newer global one)"""
+        now = self.clock()
+        with self._lock:
+            for source, command in list(self._latest.items()):
+                if now - command.stamp > self.max_age:
+                    del self._latest[source]
+                    if command is not self._taken:
+                        self.stale += 1
+            if not self._latest:
+                return None, False
+
+            newest = max(self._latest.values(), key=lambda c: c.seq)
+            local = self._latest.get('lp')
+            if self.obstacles and local is not None and local.seq >= self.obstacle_since:
+                return local, newest is not local
+            return newest, False
+
+    def _take(self, command, overrides):
+        if overrides:
+            self.overrides += 1
+        if command is self._taken:
+            self.repeated += 1
+        else:
+            self.driven += 1
+            self._taken = command
+        return command
+
+    def select(self):
+        """:return: the Command to drive now, None if there is no fresh one"""
+        command, overrides = self._pick()
+        if command is None:
+            return None
+        return self._take(command, overrides)
+
+    def consume(self, timeout=None):
+        """
+        :param timeout: seconds, None waits forever
+        :return: the Command to drive once it differs from the last one taken, None on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            command, overrides = self._pick()
+            if command is not None and command is not self._taken:
+                return self._take(command, overrides)
+            self._ready.clear()
+            # a publish between _pick() and clear() is caught here
+            command, overrides = self._pick()
+            if command is not None and command is not self._taken:
+                return self._take(command, overrides)
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            self._ready.wait(remaining)
+
+    def stats(self):
+        return (f"{self.name}: published {self.published}, driven {self.driven}, repeated {self.repeated}, "
+                f"replaced unused {self.replaced}, stale {self.stale}, local overrides {self.overrides}, "
+                f"mode switches {self.switches}")
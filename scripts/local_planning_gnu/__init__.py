@@ -0,0 +1,23 @@
+"""
+Planner core shared by the ROS scripts in scripts/.
+
+One implementation of the car-frame geometry (geometry), the friction
+speed limit (speed) and the steering strategies (strategies): FGM-GNU,
+FGM-Seoultech, ODG-PF and pure pursuit. The scripts only turn messages into
+a Frame, call Strategy.plan() and publish; the scan filter is
+scan_processing.ScanFilter, the lookahead waypoint comes from a
+WaypointTracker (tracking) over waypoints.load_waypoints.
+
+    tracker = WaypointTracker.load(wpt_path, ',', look)
+    strategy = FGMGNU(FrictionSpeed(mu, g, max_speed, robot_length), 20.0, 1.5, robot_length, threshold)
+    tracker.update(position, speed)
+    frame.wp_rt = tracker.wp_rt(position)
+    speed, steering_angle = strategy.plan(frame, stage_timer)
+
+Like the other modules the package is imported from scripts/, where the
+ROS scripts, replay.py and sim.py run.
+"""
+from .geometry import PI, distance, odom_pose, quaternion_yaw, transform_point, xyt2rt
+from .speed import FrictionSpeed, angle_speed
+from .tracking import WaypointTracker
+from .strategies import FGMGNU, FGMSeoultech, ODGPF, STRATEGIES, Frame, PurePursuit, Strategy
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import math
+
+# the planners' 'pi' param default, kept so angles match the old per-script copies
+PI = 3.141592
+
+
+def distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+def transform_point(origin, target, pi=PI):
+    """
+    target (x, y, theta) in the car frame of origin, x to the right and y
+    straight ahead (the heading is turned onto +y).
+    """
+    theta = pi/2 - origin[2]
+    dx = target[0] - origin[0]
+    dy = target[1] - origin[1]
+    cos, sin = math.cos(theta), math.sin(theta)
+    return [dx*cos - dy*sin, dx*sin + dy*cos, target[2] + theta]
+
+
+def xyt2rt(point, pi=PI):
+    """car frame (x, y) -> [r, theta], theta 0 straight ahead and positive to the left"""
+    x, y = point[0], point[1]
+    return [math.hypot(x, y), math.atan2(y, x) - pi/2]
+
+
+def quaternion_yaw(q):
+    siny_cosp = 2.0*(q.w*q.z + q.x*q.y)
+    cosy_cosp = 1.0 - 2.0*(q.y*q.y + q.z*q.z)
+    return math.atan2(siny_cosp, cosy_cosp)
+
+
+def odom_pose(odom_msg):
+    """:return: ([x, y, yaw], speed, yaw rate) of a nav_msgs/Odometry"""
+    pose = odom_msg.pose.pose
+    twist = odom_msg.twist.twist
+    return [pose.position.x, pose.position.y, quaternion_yaw(pose.orientation)], twist.linear.x, twist.angular.z
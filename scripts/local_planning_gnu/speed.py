@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+from .geometry import PI
+
+
+class FrictionSpeed:
+    """
+    Speed command from the free distance straight ahead, the
+    speed_controller() every planner but FGM-Seoultech had its own copy of.
+
+    The mean range over the `front` beams (less 0.7 s of travel above
+    10 m/s) gives the limit sqrt(2*mu*g*d) - 2, at most max_speed.
+    Below the limit the command closes accel_gain of the gap (fast_gain at
+    10 m/s and more), above it 0.2 of it.
+
+    A NaN scan counts in scan_errors and is taken as 1 m free, the first
+    and every 100th one are passed to `log`.
+    """
+    def __init__(self, mu, g, max_speed, accel_gain, fast_gain=0.8, front=(499, 580), log=None):
+        self.MU = mu
+        self.GRAVITY_ACC = g
+        self.SPEED_MAX = max_speed
+        self.accel_gain = accel_gain
+        self.fast_gain = fast_gain
+        self.front = slice(*front)
+        self.log = log
+        self.scan_errors = 0
+
+    def limit(self, scan, current_speed):
+        current_distance = math.fabs(float(np.mean(scan[self.front])))
+        if math.isnan(current_distance):
+            self.scan_errors += 1
+            if self.log is not None and self.scan_errors % 100 == 1:
+                self.log(f"NaN in the front beams ({self.scan_errors} scans), taking 1 m free")
+            current_distance = 1.0
+
+        if current_speed > 10:
+            current_distance -= current_speed*0.7
+
+        # the distance left can turn negative at speed, its magnitude is used
+        return min(math.sqrt(2*self.MU*self.GRAVITY_ACC*math.fabs(current_distance)) - 2, self.SPEED_MAX)
+
+    def command(self, scan, current_speed):
+        maximum_speed = self.limit(scan, current_speed)
+        if current_speed <= maximum_speed:
+            gain = self.fast_gain if current_speed >= 10 else self.accel_gain
+            return current_speed + math.fabs((maximum_speed - current_speed)*gain)
+        return current_speed - math.fabs((maximum_speed - current_speed)*0.2)
+
+
+def angle_speed(max_angle, steering_angle, speed_max, speed_min, pi=PI):
+    """FGM-Seoultech: min_speed beyond pi/8 of steering, else falling linearly with the gap angle"""
+    if math.fabs(steering_angle) > pi/8:
+        return speed_min
+    return math.fabs(-(3/pi)*(speed_max - speed_min)*math.fabs(max_angle) + speed_max)
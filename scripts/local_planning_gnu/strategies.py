@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+from gaps import GapIndex, find_gaps
+from potential_field import PotentialField
+from scan_processing import window_average, profile_min
+
+from .geometry import PI
+from .speed import angle_speed
+
+
+class Frame:
+    """
+    Inputs of one planning cycle.
+
+    scan / scan_filtered are the raw and the bubble-filtered ranges, wp_rt
+    the lookahead waypoint as [r, theta] and wp_xy the same point in the car
+    frame (x right, y ahead), lookahead its distance along the track.
+    """
+    __slots__ = ('scan', 'scan_filtered', 'interval', 'scan_range', 'front_idx', 'wp_rt', 'wp_xy', 'lookahead',
+                 'speed', 'degraded')
+
+    def __init__(self, scan=None, scan_filtered=None, interval=0.00435, scan_range=0, wp_rt=(0, 0), wp_xy=(0, 0, 0),
+                 lookahead=0.0, speed=0.0, degraded=False):
+        self.scan = scan
+        self.scan_filtered = scan_filtered
+        self.interval = interval
+        self.scan_range = scan_range
+        self.front_idx = (int)(scan_range/2)
+        self.wp_rt = wp_rt
+        self.wp_xy = wp_xy
+        self.lookahead = lookahead
+        self.speed = speed
+        self.degraded = degraded
+
+    def set_scan(self, scan, scan_filtered, interval, scan_range):
+        self.scan = scan
+        self.scan_filtered = scan_filtered
+        self.interval = interval
+        self.scan_range = scan_range
+        self.front_idx = (int)(scan_range/2)
+
+
+class Strategy:
+    """
+    Steering and speed law of one planner.
+
+    plan(frame, timer) returns (speed, steering_angle) and laps its stages on
+    the StageTimer: the search stages of target(), then prefix + 'steering'
+    and prefix + 'speed' (prefix 'lp_' / 'gp_' in the _pp pipelines).
+    speed is the FrictionSpeed the default speed() commands with.
+    """
+    def __init__(self, speed, prefix=''):
+        self.speed_control = speed
+        self.STEERING_STAGE = prefix + 'steering'
+        self.SPEED_STAGE = prefix + 'speed'
+
+    def target(self, frame, timer, t):
+        """:return: (what steer() aims at, timer stamp)"""
+        return None, t
+
+    def steer(self, frame, target):
+        raise NotImplementedError
+
+    def speed(self, frame, steering_angle):
+        return self.speed_control.command(frame.scan_filtered, frame.speed)
+
+    def plan(self, frame, timer):
+        t = timer.now()
+        target, t = self.target(frame, timer, t)
+        steering_angle = self.steer(frame, target)
+        t = timer.lap(self.STEERING_STAGE, t)
+        speed = self.speed(frame, steering_angle)
+        timer.lap(self.SPEED_STAGE, t)
+        return speed, steering_angle
+
+
+class FGMGNU(Strategy):
+    """
+    Follow-the-gap towards the waypoint. The aim into the gap (max_angle) and
+    the waypoint angle are weighted GAP_THETA_GAIN/dmin : REF_THETA_GAIN,
+    dmin the closest window average of the scan, and steered along an arc
+    through a point 1 m ahead.
+
+    Gaps are the runs over `threshold` within search=(start, stop) (the whole
+    scan by default). The one containing or nearest the waypoint beam is
+    taken, or the best by `score` (GapIndex.best). aim='max' heads for the
+    farthest beam of the gap, 'center' for its middle. Without gaps the
+    farthest beam within theta_for of the front is taken.
+    """
+    def __init__(self, speed, gap_theta_gain, ref_theta_gain, robot_length, threshold, gap_size=1, search=None,
+                 score=None, aim='max', theta_for=PI/3, degraded_fov=PI/6, degraded_step=2, prefix=''):
+        super().__init__(speed, prefix)
+        self.GAP_THETA_GAIN = gap_theta_gain
+        self.REF_THETA_GAIN = ref_theta_gain
+        self.RACECAR_LENGTH = robot_length
+        self.THRESHOLD = threshold
+        self.GAP_SIZE = gap_size
+        self.search = search
+        self.score = score
+        self.aim = aim
+        self.theta_for = theta_for
+        self.DEGRADED_FOV = degraded_fov
+        self.DEGRADED_STEP = degraded_step
+
+        self.gaps = []
+        self.max_angle = 0
+        self.dmin_past = 0
+
+    def find_gap(self, frame):
+        start, stop = self.search or (0, frame.scan_range)
+        if frame.degraded:
+            fov = (int)(self.DEGRADED_FOV/frame.interval)
+            self.gaps = find_gaps(frame.scan_filtered, self.THRESHOLD, max(frame.front_idx - fov, start),
+                                  min(frame.front_idx + fov, stop), self.GAP_SIZE, self.DEGRADED_STEP)
+        else:
+            self.gaps = find_gaps(frame.scan_filtered, self.THRESHOLD, start, stop, self.GAP_SIZE)
+        self.gap_index = GapIndex(self.gaps)
+
+    def for_find_gap(self, frame):
+        """[start, end, farthest beam] of the forward window, the first one on a tie"""
+        for_point = (int)(self.theta_for/frame.interval)
+        start = frame.front_idx - for_point
+        end = frame.front_idx + for_point
+        step = self.DEGRADED_STEP if frame.degraded else 1
+        return [start, end, start + step*int(np.argmax(frame.scan_filtered[start:end:step]))]
+
+    def find_best_gap(self, frame):
+        if len(self.gaps) == 0:
+            return self.for_find_gap(frame)
+
+        ref_idx = frame.front_idx + (int)(frame.wp_rt[1]/frame.interval)
+        if self.score is None:
+            return self.gaps[self.gap_index.nearest(ref_idx)]
+        return self.gaps[self.gap_index.best(1, self.score, ref_idx)[0]]
+
+    def target(self, frame, timer, t):
+        self.find_gap(frame)
+        goal = self.find_best_gap(frame)
+        return goal, timer.lap('gap_search', t)
+
+    def steer(self, frame, goal):
+        if self.aim == 'center':
+            self.max_angle = ((goal[0] + goal[1])/2 - frame.front_idx)*frame.interval
+        else:
+            self.max_angle = (goal[2] - frame.front_idx)*frame.interval
+
+        dmin = profile_min(window_average(frame.scan_filtered))
+        if dmin == 0:
+            dmin = self.dmin_past
+        self.dmin_past = dmin
+
+        gap_gain = self.GAP_THETA_GAIN/dmin
+        controlled_angle = (gap_gain*self.max_angle + self.REF_THETA_GAIN*frame.wp_rt[1])/(gap_gain + self.REF_THETA_GAIN)
+        # path_radius = distance/(2 sin(controlled_angle)) with distance 1 m
+        return math.atan(self.RACECAR_LENGTH*2*math.sin(controlled_angle))
+
+
+class FGMSeoultech(FGMGNU):
+    """FGM-GNU steering, the speed falls with the gap angle instead of the friction limit (angle_speed)."""
+    def __init__(self, speed_max, speed_min, gap_theta_gain, ref_theta_gain, robot_length, threshold, pi=PI, **kwargs):
+        super().__init__(None, gap_theta_gain, ref_theta_gain, robot_length, threshold, **kwargs)
+        self.SPEED_MAX = speed_max
+        self.SPEED_MIN = speed_min
+        self.PI = pi
+
+    def speed(self, frame, steering_angle):
+        return angle_speed(self.max_angle, steering_angle, self.SPEED_MAX, self.SPEED_MIN, self.PI)
+
+
+class ODGPF(Strategy):
+    """
+    Obstacle-dependent Gaussian potential field. Every run of beams closer
+    than `threshold` in the detect window becomes a repulsive Gaussian of
+    height (threshold - mean range)*obstacle_scale, the waypoint angle pulls
+    with gamma*|angle| (PotentialField). The car steers for the minimum of
+    the total field along an arc of look_base + look_gain*speed, to the
+    power look_exp.
+
+    The degraded window (degraded_fov around the front, every
+    degraded_step-th beam, within detect) follows the geometry of the
+    frames' scans. obstacles_from='origin' builds the obstacles from the raw
+    scan.
+    """
+    def __init__(self, speed, robot_length, robot_scale, threshold, gamma, obstacle_scale, look_base, look_gain,
+                 look_exp=2, detect=(299, 779), truncate=None, degraded_fov=PI/6, degraded_step=2,
+                 obstacles_from='filtered', prefix=''):
+        super().__init__(speed, prefix)
+        self.ROBOT_LENGTH = robot_length
+        self.ROBOT_SCALE = robot_scale
+        self.THRESHOLD = threshold
+        self.gamma = gamma
+        self.OBSTACLE_SCALE = obstacle_scale
+        self.LOOK_BASE = look_base
+        self.LOOK_GAIN = look_gain
+        self.LOOK_EXP = look_exp
+        self.obstacles_from = obstacles_from
+
+        self.detect_range_s, self.detect_range_e = detect
+        self.field = PotentialField(self.detect_range_s, self.detect_range_e, truncate)
+
+        self.truncate = truncate
+        self.DEGRADED_FOV = degraded_fov
+        self.DEGRADED_STEP = degraded_step
+        self.degraded_field = None
+        self._degraded_geometry = None
+
+        self.LOOK = look_base
+        self.min_idx = 0
+        self.f_total_list = []
+        self.steering_angle = 0
+
+    def define_obstacles(self, scan, start, stop, interval, front_idx, step=1):
+        """:return: [center (beams from front_idx), sigma (rad), a_k] of every run below THRESHOLD"""
+        obstacles = []
+        threshold = self.THRESHOLD
+
+        i = start
+        while i < stop:
+            if scan[i] < threshold:
+                start_idx = i
+                total = scan[i]
+                count = 1
+                while scan[i] < threshold and i + step < stop:
+                    i += step
+                    total += scan[i]
+                    count += 1
+                if scan[i] < threshold:
+                    i += step
+                end_idx = min(i, stop)
+
+                distance_obstacle = total/count
+                a_k = (threshold - distance_obstacle)*self.OBSTACLE_SCALE
+                angle_obstacle = (end_idx - start_idx)*interval
+                sigma_obstacle = math.atan2(distance_obstacle*math.tan(angle_obstacle/2) + self.ROBOT_SCALE/2, distance_obstacle)
+                center = (int)((end_idx - start_idx)/2) + start_idx - front_idx
+                obstacles.append([center, sigma_obstacle, a_k])
+            i += step
+
+        return obstacles
+
+    def degraded_window(self, frame):
+        """The degraded field of the frame's scan geometry, rebuilt when it changes."""
+        geometry = (frame.scan_range, frame.interval)
+        if geometry != self._degraded_geometry:
+            fov = (int)(self.DEGRADED_FOV/frame.interval)
+            self.degraded_range_s = max(frame.front_idx - fov, self.detect_range_s)
+            self.degraded_range_e = min(frame.front_idx + fov, self.detect_range_e)
+            self.degraded_field = PotentialField(self.degraded_range_s, self.degraded_range_e, self.truncate,
+                                                 step=self.DEGRADED_STEP)
+            self._degraded_geometry = geometry
+        return self.degraded_field
+
+    def target(self, frame, timer, t):
+        scan = frame.scan if self.obstacles_from == 'origin' else frame.scan_filtered
+        if frame.degraded:
+            field = self.degraded_window(frame)
+            obstacles = self.define_obstacles(scan, self.degraded_range_s, self.degraded_range_e, frame.interval,
+                                              frame.front_idx, self.DEGRADED_STEP)
+        else:
+            obstacles = self.define_obstacles(scan, self.detect_range_s, self.detect_range_e, frame.interval, frame.front_idx)
+            field = self.field
+        t = timer.lap('obstacles', t)
+
+        field.configure(frame.scan_range, frame.interval)
+        self.min_idx, self.f_total_list = field.solve(obstacles, frame.wp_rt[1], self.gamma)
+        return self.min_idx, timer.lap('field', t)
+
+    def steer(self, frame, goal):
+        self.steering_angle = (goal - frame.front_idx)*frame.interval
+        controlled_angle = self.steering_angle
+        if controlled_angle == 0.0:
+            controlled_angle = 0.001
+
+        # a longer LOOK steers less
+        self.LOOK = self.LOOK_BASE + self.LOOK_GAIN*frame.speed
+        path_radius = self.LOOK**self.LOOK_EXP/(2*math.sin(controlled_angle))
+        return math.atan(self.ROBOT_LENGTH/path_radius)
+
+
+class PurePursuit(Strategy):
+    """Pure pursuit of the lookahead waypoint wp_xy, on the arc of radius lookahead^2/(2|x|)."""
+    def __init__(self, speed, robot_length, prefix=''):
+        super().__init__(speed, prefix)
+        self.RACECAR_LENGTH = robot_length
+
+    def steer(self, frame, target):
+        x = frame.wp_xy[0]
+        # atan2(L, goal_path_radius), right (x > 0) is negative
+        steering_angle = math.atan2(self.RACECAR_LENGTH*2*math.fabs(x), frame.lookahead*frame.lookahead)
+        return -steering_angle if x > 0 else steering_angle
+
+
+STRATEGIES = {
+    'fgm_gnu': FGMGNU,
+    'fgm_stech': FGMSeoultech,
+    'odg_pf': ODGPF,
+    'pure_pursuit': PurePursuit,
+}
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from waypoints import WaypointIndex, load_waypoints
+
+from .geometry import PI, transform_point, xyt2rt
+
+
+class WaypointTracker:
+    """
+    The car's place on the waypoint track and its lookahead waypoint.
+
+    The lookahead distance is look_base + look_gain * speed (look_gain 0 for
+    a fixed one). update() moves along the track, wp_xy() / wp_rt() give the
+    lookahead waypoint in the car frame as Frame.wp_xy / Frame.wp_rt.
+
+        tracker = WaypointTracker.load(wpt_path, ',', 0.5, 0.3)
+        tracker.update(position, speed)
+        frame.wp_rt = tracker.wp_rt(position)
+    """
+    def __init__(self, waypoints, look_base, look_gain=0.0, pi=PI):
+        """
+        :param waypoints: table from load_waypoints() or an (N, 2+) array
+        """
+        self.waypoints = waypoints
+        self.index = WaypointIndex(waypoints)
+        self.look_base = look_base
+        self.look_gain = look_gain
+        self.pi = pi
+
+        self.current = 0
+        self.nearest_distance = 0.0
+        self.target = 0
+        self.lookahead = 0.0
+
+    @classmethod
+    def load(cls, csv_path, delimiter, look_base, look_gain=0.0, pi=PI):
+        return cls(load_waypoints(csv_path, delimiter), look_base, look_gain, pi)
+
+    def update(self, position, speed=0.0):
+        """
+        :param position: [x, y, yaw, ...] in the map frame
+        :return: index of the lookahead waypoint
+        """
+        self.current, self.nearest_distance = self.index.nearest(position, self.current)
+        self.target, self.lookahead = self.index.lookahead(position, self.current, self.look_base + self.look_gain*speed)
+        return self.target
+
+    def point(self):
+        """lookahead waypoint [x, y, heading] in the map frame"""
+        return self.index.point(self.target)
+
+    def wp_xy(self, position):
+        return transform_point(position, self.index.point(self.target), self.pi)
+
+    def wp_rt(self, position):
+        return xyt2rt(self.wp_xy(position), self.pi)
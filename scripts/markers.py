@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+from visualization_msgs.msg import Marker
+
+
+def lookahead_marker(point, stamp, frame_id="map"):
+    """red cube on the lookahead waypoint point = [x, y, ...] (ns "mpc", id 2)"""
+    marker = Marker()
+    marker.header.frame_id = frame_id
+    marker.header.stamp = stamp
+    marker.ns = "mpc"
+    marker.id = 2
+    marker.type = marker.CUBE
+    marker.action = marker.ADD
+    marker.pose.position.x = point[0]
+    marker.pose.position.y = point[1]
+    marker.pose.position.z = 0.1
+    marker.pose.orientation.x = 0.0
+    marker.pose.orientation.y = 0.0
+    marker.pose.orientation.z = 0.0
+    marker.pose.orientation.w = 1.0
+    marker.scale.x = 0.2
+    marker.scale.y = 0.2
+    marker.scale.z = 0.1
+    marker.color.a = 1.0
+    marker.color.r = 1.0
+    marker.color.g = 0.0
+    marker.color.b = 0.0
+    return marker
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import rospy
+from rospy.numpy_msg import numpy_msg
+import numpy as np
+import threading
+import time
+
+from sensor_msgs.msg import LaserScan
+from nav_msgs.msg import Odometry
+from visualization_msgs.msg import Marker
+from f1tenth_gym_ros.msg import RaceInfo
+
+from scan_processing import ScanFilter, cluster_scan, cluster_length
+from time_logger import TimeLogger
+from trajectory_recorder import TrajectoryRecorder
+from handoff import ScanTrigger
+from markers import lookahead_marker
+from local_planning_gnu import WaypointTracker, odom_pose
+
+
+class Obstacle_detect(threading.Thread):
+    """
+    Front end of the _pp pipelines (fgm_pp, odg_pf_pp): per scan it checks
+    for obstacles ahead and hands the frame to local_od_q (obstacle, wp_rt)
+    or global_od_q (free track, wp_xy).
+
+    :param name: planner name, for the time data file
+    """
+    def __init__(self, global_od_q, local_od_q, stage_timer, cycle_budget, main_q, name):
+        super(Obstacle_detect, self).__init__()
+        self.global_od_q = global_od_q
+        self.local_od_q = local_od_q
+        self.main_q = main_q
+        self.stage_timer = stage_timer
+        self.cycle_budget = cycle_budget
+
+        self.odom_topic = rospy.get_param("odom_topic", "/odom")
+        self.scan_topic = rospy.get_param("scan_topic", "/scan")
+        self.marker_topic = rospy.get_param("marker_topic", "/marker")
+
+        self.time_data_file_name = f"{name}_time_data"
+        self.time_data_path = rospy.get_param("time_data_path")
+        self.time_logger = TimeLogger(f"{self.time_data_path}/{self.time_data_file_name}.rec")
+
+        self.waypoint_real_path = rospy.get_param('wpt_path', '../f1tenth_ws/src/car_duri/wp_vegas_test.csv')
+        self.waypoint_delimeter = rospy.get_param('wpt_delimeter', ',')
+
+        self.interval = 0.00435
+        self.scan_range = 0
+
+        self.scan_origin = [0]*1080
+        self.scan_filtered = [0]*1080
+        self.scan_obs = []
+        self.len_obs = []
+        self.obs = False
+        self.ROBOT_SCALE = rospy.get_param('robot_scale', 0.35)
+        self.FILTER_SCALE = rospy.get_param('filter_scale', 1.1)
+        self.scan_filter = ScanFilter(self.ROBOT_SCALE, self.FILTER_SCALE, fill_filtered=False)
+
+        self.PI = rospy.get_param('pi', 3.141592)
+        self.RATE = rospy.get_param('rate', 100)
+        self.scan_trigger = ScanTrigger(self.RATE, rospy.get_param('scan_deadline', 0.1))
+        self.scan_stamp = None
+        self.odom_stamp = None
+
+        self.current_position = [0]*5
+        self.lidar_data = [0]*3
+        self.current_speed = 0
+        self.tracker = WaypointTracker.load(self.waypoint_real_path, self.waypoint_delimeter, 0.5, 0.3, self.PI)
+
+        self.marker_pub = rospy.Publisher(self.marker_topic, Marker, queue_size=10)
+        rospy.Subscriber(self.scan_topic, numpy_msg(LaserScan), self.subCallback_od, queue_size=10)
+        rospy.Subscriber(self.odom_topic, Odometry, self.Odome, queue_size = 10)
+
+        # FOR TRAJECTORY LOGGING
+        rospy.Subscriber("/race_info",RaceInfo,self.update_race_info,queue_size=10)
+        self.tr_flag = rospy.get_param('logging',False)
+        trj_path = rospy.get_param('trj_path')
+
+        self.race_info = None
+        self.lap = 0
+
+        self.logging_idx = 0
+        self.race_time = 0
+        self.t_start = 0
+
+        if self.tr_flag:
+            self.trajectory = TrajectoryRecorder(trj_path, binary=rospy.get_param('trj_binary', True))
+
+    def update_race_info(self,race_info):
+        self.race_info = race_info
+        self.race_time = race_info.ego_elapsed_time
+
+        if self.race_info.ego_lap_count > self.lap:
+            print('lap_count',self.race_info.ego_lap_count,'elapsed_time',self.race_info.ego_elapsed_time,'collision',self.race_info.ego_collision)
+            self.lap += 1
+
+    def Odome(self, odom_msg):
+        self.odom_stamp = odom_msg.header.stamp
+        pose, self.current_speed, yaw_rate = odom_pose(odom_msg)
+        self.current_position = pose + [self.current_speed, yaw_rate]
+
+    def find_desired_wp(self):
+        self.tracker.update(self.current_position, self.current_speed)
+        if self.cycle_budget.degraded:
+            return
+        self.marker_pub.publish(lookahead_marker(self.tracker.point(), rospy.Time.now()))
+
+    def subCallback_od(self, msg_sub):
+        if self.scan_trigger.duplicate(msg_sub.header.stamp): return
+        self.interval = msg_sub.angle_increment
+        self.scan_range = len(msg_sub.ranges)
+
+        self.scan_origin, self.scan_filtered = self.scan_filter.process(msg_sub.ranges, self.interval, self.stage_timer)
+        self.lidar_data = [self.interval, self.scan_range, self.scan_origin, self.scan_filtered]
+        self.scan_stamp = msg_sub.header.stamp
+        self.scan_trigger.notify()
+
+    def obs_dect(self):
+        self.scan_obs = cluster_scan(self.scan_origin, d_group=1.5, d_pi=0.00628)
+
+        # close (0 < max range < 4) and short (< 2 m) clusters in one pass
+        with np.errstate(invalid='ignore'):
+            near = (self.scan_obs['max'] < 4) & (self.scan_obs['max'] > 0)
+            short = cluster_length(self.scan_origin, self.scan_obs) < 2
+        self.len_obs = self.scan_obs[near & short]
+
+        # any of them overlapping beams 400 .. 680
+        self.obs = bool(np.any((self.len_obs['start'] <= 680) & (self.len_obs['end'] >= 400)))
+
+    def trajectory_logging(self):
+        self.race_time = time.time() - self.t_start
+        if self.logging_idx <= self.tracker.current:
+            self.trajectory.record(self.race_time, self.current_position[0], self.current_position[1], self.current_position[2], self.current_speed)
+            self.logging_idx += 1
+
+    def run(self):
+        self.t_start = time.time()
+        t0 = time.time()
+        loop = 0
+
+        while not rospy.is_shutdown():
+            if not self.scan_trigger.wait(): continue
+            scan_stamp, odom_stamp = self.scan_stamp, self.odom_stamp
+            loop += 1
+            t1 = time.time()
+
+            t = self.stage_timer.now()
+            self.obs_dect()
+            self.stage_timer.lap('obs_detect', t)
+            if self.tr_flag:
+                self.trajectory_logging()
+
+            t = self.stage_timer.now()
+            self.find_desired_wp()
+            t = self.stage_timer.lap('waypoint', t)
+            # the arbiter lets local override global from this frame on
+            self.main_q.obstacle(self.obs, loop)
+            if self.obs:
+                sensor_data = [self.current_position, self.lidar_data, self.tracker.wp_rt(self.current_position), self.tracker.lookahead,
+                               [loop, t0, t1], self.time_logger, (loop, "lp", scan_stamp, odom_stamp)]
+                self.local_od_q.publish(sensor_data)
+            else:
+                sensor_data = [self.current_position, self.lidar_data, self.tracker.wp_xy(self.current_position), self.tracker.lookahead,
+                               [loop, t0, t1], self.time_logger, (loop, "gp", scan_stamp, odom_stamp)]
+                self.global_od_q.publish(sensor_data)
+            self.stage_timer.lap('handoff', t)
+
+            if self.stage_timer.report_due():
+                rospy.loginfo("\n" + self.stage_timer.report(rolling=True))
+
+        print(self.scan_trigger.stats())
+        self.time_logger.close()
+        print(self.time_logger.stats())
+
+        if self.tr_flag:
+            print(self.race_time)
+            self.trajectory.close()
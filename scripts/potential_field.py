@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class PotentialField:
+    """
+    ODG-PF field evaluation over the beams start .. stop-1.
+
+    Obstacles are [center (beams from front_idx), sigma (rad), a_k] as built by
+    define_obstacles(). repulsive() evaluates every obstacle Gaussian in one
+    (obstacles x beams) broadcast inside preallocated buffers. Squares are
+    taken as x*x instead of pow(x, 2), so values may differ from the old
+    per-beam loop in the last bit.
+
+    solve() adds the attractive field gamma*|goal angle - beam angle| from the
+    same beam-angle table and returns the argmin of the total field.
+
+    f_rep, f_att and f_total are indexed by beam like the scan, only
+    start .. stop-1 is ever written.
+
+    truncate=k only evaluates each Gaussian within k*sigma of its center,
+    everything farther away is taken as 0.
+
+    step > 1 only evaluates every step-th beam of the window.
+    """
+    def __init__(self, start, stop, truncate=None, max_obstacles=16, step=1):
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.window = slice(start, stop, step)
+        self.width = len(range(start, stop, step))
+        self.truncate = truncate
+        self.scan_range = 0
+        self.interval = 0
+        self._work = np.zeros((max_obstacles, self.width))
+
+    def configure(self, scan_range, interval):
+        """Rebuild the beam-angle table when the scan geometry changes."""
+        if scan_range == self.scan_range and interval == self.interval:
+            return
+        self.scan_range = scan_range
+        self.interval = interval
+        self.front_idx = (int)(scan_range/2)
+        self.angle = (np.arange(scan_range) - self.front_idx)*interval
+        self.f_rep = np.zeros(scan_range)
+        self.f_att = np.zeros(scan_range)
+        self.f_total = np.zeros(scan_range)
+
+    def _workspace(self, rows):
+        if rows > len(self._work):
+            self._work = np.zeros((rows, self.width))
+        return self._work[:rows]
+
+    def repulsive(self, obstacles):
+        """
+        :return: f_rep over the whole scan (a buffer reused by the next call)
+        """
+        f_rep = self.f_rep
+        f_rep[:] = 0
+        if len(obstacles) == 0:
+            return f_rep
+
+        obstacles = np.asarray(obstacles, dtype=np.float64)
+        center = obstacles[:, 0:1]*self.interval
+        sigma2 = obstacles[:, 1:2]**2
+        a_k = obstacles[:, 2:3]
+
+        if self.truncate is not None:
+            return self._repulsive_truncated(center[:, 0], np.sqrt(sigma2[:, 0]), a_k[:, 0])
+
+        work = self._workspace(len(obstacles))
+        np.subtract(self.angle[self.window], center, out=work)
+        np.square(work, out=work)
+        np.divide(work, sigma2, out=work)
+        np.multiply(work, -0.5, out=work)
+        np.exp(work, out=work)
+        np.multiply(work, a_k, out=work)
+
+        # obstacle by obstacle, in the order the per-beam loop added them up
+        out = f_rep[self.window]
+        out[:] = work[0]
+        for row in work[1:]:
+            out += row
+        return f_rep
+
+    def solve(self, obstacles, goal_angle, gamma):
+        """
+        :param goal_angle: desired direction (rad, 0 = front_idx)
+        :return: (beam index of the minimum total field, f_total)
+        """
+        window = self.window
+        f_rep = self.repulsive(obstacles)[window]
+
+        f_att = self.f_att[window]
+        np.subtract(goal_angle, self.angle[window], out=f_att)
+        np.fabs(f_att, out=f_att)
+        np.multiply(f_att, gamma, out=f_att)
+
+        f_total = self.f_total[window]
+        np.add(f_rep, f_att, out=f_total)
+        return self.start + self.step*int(np.argmin(f_total)), self.f_total
+
+    def _repulsive_truncated(self, center, sigma, a_k):
+        half_width = np.ceil(self.truncate*sigma/self.interval).astype(np.int64)
+        center_idx = np.rint(center/self.interval).astype(np.int64) + self.front_idx
+        step = self.step
+        lo = np.maximum(center_idx - half_width, self.start)
+        # first beam of the step grid at or after lo
+        lo = self.start + -((self.start - lo)//step)*step
+        hi = np.minimum(center_idx + half_width + 1, self.stop)
+        length = np.maximum(-((lo - hi)//step), 0)
+        total = int(length.sum())
+        if total == 0:
+            return self.f_rep
+
+        # every (obstacle, beam) pair inside the windows, evaluated at once
+        owner = np.repeat(np.arange(len(center)), length)
+        idx = np.repeat(lo, length) + step*(np.arange(total) - np.repeat(np.cumsum(length) - length, length))
+        d = self.angle[idx] - center[owner]
+        value = a_k[owner]*np.exp(-0.5*(d*d)/(sigma[owner]*sigma[owner]))
+        self.f_rep[:] = np.bincount(idx, weights=value, minlength=self.scan_range)
+        return self.f_rep
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Process mode of the _pp pipelines (param pp_processes): global_pure and
+local_fgm run in spawned processes pinned to their own cores instead of as
+threads, so the planners no longer share the GIL with Obstacle_detect and
+the ROS callbacks.
+
+    Obstacle_detect --FrameSender--> SharedFrame --> PlannerProcess (PlanStep)
+    maindrive <--main_q-- CommandCollector <--pipe-- (loop, speed, steer, done)
+
+Scan and pose go through shared memory, only the command tuple is pickled.
+What cannot leave the ROS process (the time logger, the ROS stamps) waits
+in Pending until the command of its frame comes back. The processes are
+spawned, not forked: the ROS process has its node's threads running by
+then, and a fork would copy whatever locks they hold. The ROS process
+moves to the cores the planner processes leave free, if there are any.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from handoff import Command
+from local_planning_gnu import Frame
+
+# fresh interpreters, see the module docstring
+_CTX = multiprocessing.get_context('spawn')
+# the cores the ROS process may run on, before it pins itself
+_ALLOWED = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else [None]
+
+# float64 fields of a frame, besides the two scans
+META = ('x', 'y', 'theta', 'speed', 'yaw_rate', 'interval', 'scan_range', 'wp_x', 'wp_y', 'wp_t', 'wp_len',
+        'lookahead', 't0', 't1', 'degraded')
+_M = {name: i for i, name in enumerate(META)}
+# int64 fields of a slot: seq, loop, beams
+_SLOT_INTS = 3
+# int64 header: newest seq, frames read, frames overwritten unread
+_HEADER_INTS = 3
+
+
+class SharedFrame:
+    """
+    Double-buffered scan + pose in multiprocessing.shared_memory, one writer
+    and one reader process. It pickles by name: the copy a planner process
+    unpickles attaches to the writer's memory.
+
+    write() fills the slot of seq + 1, the one the reader is not on, and then
+    bumps the seq counter in the header. read() copies the slot of the newest
+    seq. Each slot is written and copied under its own lock, a semaphore, so
+    the data is complete by the time the reader sees the slot's seq on weakly
+    ordered CPUs (aarch64) too. A read that finds its slot refilled with a
+    newer seq takes that one instead.
+    """
+    def __init__(self, beams=4096, name=None):
+        self.beams = beams
+        self.shm = shared_memory.SharedMemory(create=True, size=8*_HEADER_INTS + 2*self._slot_size())
+        self.name = name or self.shm.name
+        self._locks = (_CTX.Lock(), _CTX.Lock())
+        self._ready = _CTX.Event()
+        self.published = 0
+        self._attach()
+        self._header[:] = 0
+        for ints, _ in self._slots:
+            ints[:] = 0
+
+    def _slot_size(self):
+        return 8*(_SLOT_INTS + len(META) + 2*self.beams)
+
+    def _attach(self):
+        buf = self.shm.buf
+        self._header = np.ndarray(_HEADER_INTS, np.int64, buf)
+        self._slots = []
+        for k in range(2):
+            offset = 8*_HEADER_INTS + k*self._slot_size()
+            self._slots.append((np.ndarray(_SLOT_INTS, np.int64, buf, offset),
+                                np.ndarray(len(META) + 2*self.beams, np.float64, buf, offset + 8*_SLOT_INTS)))
+        # the reader's copies
+        self._floats = np.zeros(len(META) + 2*self.beams)
+
+    def __getstate__(self):
+        return {'beams': self.beams, 'name': self.name, 'shm': self.shm.name, 'locks': self._locks,
+                'ready': self._ready}
+
+    def __setstate__(self, state):
+        self.beams = state['beams']
+        self.name = state['name']
+        self.shm = shared_memory.SharedMemory(state['shm'])
+        self._locks = state['locks']
+        self._ready = state['ready']
+        self.published = 0
+        self._attach()
+
+    def write(self, loop, meta, scan, scan_filtered):
+        """
+        :param meta: len(META) floats
+        :return: seq of the frame
+        """
+        n = len(scan)
+        if n > self.beams:
+            raise ValueError(f"{self.name}: {n} beams, room for {self.beams}")
+        seq = int(self._header[0]) + 1
+        ints, floats = self._slots[seq % 2]
+        with self._locks[seq % 2]:
+            ints[0] = seq
+            ints[1] = loop
+            ints[2] = n
+            floats[:len(META)] = meta
+            floats[len(META):len(META) + n] = scan
+            floats[len(META) + self.beams:len(META) + self.beams + n] = scan_filtered
+        self._header[0] = seq
+        self.published += 1
+        self._ready.set()
+        return seq
+
+    def read(self, last_seq, timeout):
+        """
+        :return: (seq, loop, meta, scan, scan_filtered) of the newest frame
+                 after last_seq, copies valid until the next read(); None on
+                 timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            seq = int(self._header[0])
+            if seq > last_seq:
+                ints, floats = self._slots[seq % 2]
+                with self._locks[seq % 2]:
+                    current = ints[0] == seq
+                    if current:
+                        loop, n = int(ints[1]), int(ints[2])
+                        # meta + scan, then the filtered scan: the beams of this frame only
+                        filtered = slice(len(META) + self.beams, len(META) + self.beams + n)
+                        np.copyto(self._floats[:len(META) + n], floats[:len(META) + n])
+                        np.copyto(self._floats[filtered], floats[filtered])
+                if current:
+                    self._header[1] += 1
+                    self._header[2] += seq - last_seq - 1
+                    meta = self._floats[:len(META)]
+                    return seq, loop, meta, self._floats[len(META):len(META) + n], self._floats[filtered]
+                # the writer has refilled this slot, a newer seq is coming
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # a write between the seq check and wait() leaves the event set
+            if self._ready.wait(remaining):
+                self._ready.clear()
+
+    def stats(self):
+        return f"{self.name}: published {self.published}, consumed {self._header[1]}, dropped {self._header[2]}"
+
+    def close(self, unlink=True):
+        self._header = self._slots = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Pending:
+    """Per-frame data that stays in the ROS process, by Obstacle_detect loop."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {}
+
+    def add(self, loop, item):
+        with self._lock:
+            self._items[loop] = item
+
+    def pop(self, loop):
+        """:return: the item of loop, None if unknown; older frames are dropped"""
+        with self._lock:
+            item = self._items.pop(loop, None)
+            for old in [k for k in self._items if k < loop]:
+                del self._items[old]
+        return item
+
+
+class FrameSender:
+    """
+    Takes the place of the Mailbox Obstacle_detect publishes sensor_data to:
+    packs it into a SharedFrame and keeps the time logger and the stamps in
+    Pending. now() stamps the decision time, degraded() is the cycle budget's.
+    """
+    def __init__(self, frame, pending, now, degraded):
+        self.frame = frame
+        self.pending = pending
+        self.now = now
+        self.degraded = degraded
+        self._meta = np.zeros(len(META))
+
+    def publish(self, sensor_data):
+        position, lidar_data, wp, lookahead, times, time_logger, stamps = sensor_data
+        loop, t0, t1 = times
+        meta = self._meta
+        meta[:5] = position[:5]
+        meta[_M['interval']] = lidar_data[0]
+        meta[_M['scan_range']] = lidar_data[1]
+        meta[_M['wp_x']:_M['wp_x'] + len(wp)] = wp
+        meta[_M['wp_len']] = len(wp)
+        meta[_M['lookahead']] = lookahead
+        meta[_M['t0']] = t0
+        meta[_M['t1']] = t1
+        meta[_M['degraded']] = self.degraded()
+
+        self.pending.add(loop, (time_logger, stamps + (self.now(),), times, position[:3]))
+        return self.frame.write(loop, meta, lidar_data[2], lidar_data[3])
+
+    def stats(self):
+        return self.frame.stats()
+
+
+def sensor_data(loop, meta, scan, scan_filtered):
+    """SharedFrame contents -> the sensor_data list of Obstacle_detect (without logger and stamps)"""
+    m = meta.tolist()
+    return [m[0:5], [m[_M['interval']], int(m[_M['scan_range']]), scan, scan_filtered],
+            m[_M['wp_x']:_M['wp_x'] + int(m[_M['wp_len']])], m[_M['lookahead']], [loop, m[_M['t0']], m[_M['t1']]],
+            None, None]
+
+
+class PlanStep:
+    """
+    sensor_data of Obstacle_detect -> strategy.plan(), the part of a planner
+    worker that runs in its planner process. It holds no ROS state, so it
+    pickles into the spawned process. local=False fills the frame like
+    global_pure (the scan at lidar_data[2], the waypoint as wp_xy),
+    local=True like local_fgm (both scans, the waypoint as wp_rt).
+    """
+    def __init__(self, strategy, stage_timer, local):
+        self.strategy = strategy
+        self.stage_timer = stage_timer
+        self.local = local
+        self.frame = Frame()
+
+    def __call__(self, sensor_data, degraded=False):
+        position, lidar_data, wp, lookahead = sensor_data[:4]
+        frame = self.frame
+        if self.local:
+            frame.set_scan(lidar_data[2], lidar_data[3], lidar_data[0], lidar_data[1])
+            frame.wp_rt = wp
+            frame.degraded = degraded
+        else:
+            frame.scan_filtered = lidar_data[2]
+            frame.wp_xy = wp
+        frame.lookahead = lookahead
+        frame.speed = position[3]
+        return self.strategy.plan(frame, self.stage_timer)
+
+
+def pin(core):
+    if core is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {core})
+
+
+def pin_threads(cores):
+    """Pins every thread of this process to cores, sched_setaffinity(0) only pins the calling one."""
+    if not hasattr(os, 'sched_setaffinity'):
+        return
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            os.sched_setaffinity(int(tid), cores)
+        except ProcessLookupError:
+            pass
+
+
+def default_cores(count):
+    """count cores for the planner processes, leaving the first allowed one to the ROS process where possible"""
+    return [_ALLOWED[(k + 1) % len(_ALLOWED)] for k in range(count)]
+
+
+class PlannerProcess(_CTX.Process):
+    """
+    Runs plan_step(sensor_data, degraded) -> (speed, steer) on every frame
+    of a SharedFrame, pinned to `core`, and sends (loop, speed, steer, done)
+    back through conn. plan_step is built in the ROS process and pickled
+    into the spawned one.
+    """
+    def __init__(self, name, plan_step, frame, conn, stop, core=None):
+        super().__init__(name=name)
+        self.plan_step = plan_step
+        self.frame = frame
+        self.conn = conn
+        self.stop = stop
+        self.core = core
+
+    def run(self):
+        pin(self.core)
+        last = 0
+        while not self.stop.is_set():
+            data = self.frame.read(last, 0.1)
+            if data is None:
+                continue
+            last, loop, meta, scan, scan_filtered = data
+            speed, steer = self.plan_step(sensor_data(loop, meta, scan, scan_filtered), bool(meta[_M['degraded']]))
+            self.conn.send((loop, speed, steer, time.time()))
+        self.conn.close()
+        self.frame.close(unlink=False)
+        print(f"{self.name} (core {self.core}):\n{self.plan_step.stage_timer.report()}")
+
+
+class CommandCollector(threading.Thread):
+    """
+    Receives the command tuples of the planner processes and publishes them
+    as Commands to main_q like the planner threads do, after
+    logging the cycle and recording it on the cycle budget. Commands of
+    frames older than one already collected are dropped. On shutdown it
+    stops the processes and frees the shared memory.
+    """
+    def __init__(self, conns, main_q, pending, cycle_budget, is_shutdown, stop, processes, frames):
+        super().__init__(name='command_collector')
+        self.conns = list(conns)
+        self.main_q = main_q
+        self.pending = pending
+        self.cycle_budget = cycle_budget
+        self.is_shutdown = is_shutdown
+        self.stop = stop
+        self.processes = processes
+        self.frames = frames
+
+    def run(self):
+        while not self.is_shutdown() and self.conns:
+            for conn in multiprocessing.connection.wait(self.conns, timeout=0.1):
+                try:
+                    loop, speed, steer, done = conn.recv()
+                except EOFError:
+                    self.conns.remove(conn)
+                    continue
+                item = self.pending.pop(loop)
+                if item is None:
+                    continue
+                time_logger, stamps, (t_loop, t0, t1), pose = item
+                self.main_q.publish(Command(speed, steer, stamps[1], t_loop, t1, stamps))
+                time_logger.log(t_loop, done - t0, done - t1, stamps[1], speed, steer, pose)
+                self.cycle_budget.record(done - t1)
+
+        self.stop.set()
+        for p in self.processes:
+            p.join(1.0)
+        for frame in self.frames:
+            frame.close()
+
+
+def planner_processes(global_step, local_step, main_q, cycle_budget, now, is_shutdown, cores=None, beams=4096):
+    """
+    Process mode around the PlanSteps of the global / local planner workers.
+    now and is_shutdown are only called in the ROS process.
+
+    :return: (processes + collector, not started yet, and the global / local FrameSender)
+    """
+    cores = cores or default_cores(2)
+    # the ROS process, rospy's threads included, keeps off the planners' cores;
+    # with no core left over it stays unpinned and shares them
+    free = set(_ALLOWED) - set(cores) - {None}
+    if free:
+        pin_threads(free)
+    stop = _CTX.Event()
+    pending = Pending()
+    degraded = lambda: cycle_budget.degraded
+
+    processes, conns, senders, frames = [], [], [], []
+    for name, plan_step, core in (('global_pure', global_step, cores[0]), ('local_fgm', local_step, cores[1])):
+        frame = SharedFrame(beams, f"{name}_frame")
+        recv_conn, send_conn = _CTX.Pipe(duplex=False)
+        processes.append(PlannerProcess(name, plan_step, frame, send_conn, stop, core))
+        conns.append(recv_conn)
+        senders.append(FrameSender(frame, pending, now, degraded))
+        frames.append(frame)
+
+    collector = CommandCollector(conns, main_q, pending, cycle_budget, is_shutdown, stop, processes, frames)
+    return (*processes, collector), senders
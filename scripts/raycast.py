@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulated LiDAR scans over the map_server maps in map/ (yaml + png/pgm).
+
+The map is turned into a distance transform once: every cell holds the
+distance (m) to the nearest occupied cell. Rays are then sphere traced, each
+step advances a ray by (about) the free distance around it, so open space
+takes few steps. Ranges are within a cell of the exact ones, a ray grazing
+the corner of a single occupied cell may pass it. All rays of a batch of
+poses are traced together and finished rays drop out of the arrays.
+
+    caster = MapRaycaster("../map/vegas_test.yaml")
+    ranges = caster.scans(poses)        # (poses x 1080) float32
+"""
+import os
+
+import numpy as np
+import yaml
+from PIL import Image
+from scipy.ndimage import distance_transform_edt
+
+
+def load_map(yaml_path, obstacles=()):
+    """
+    :param obstacles: (x, y, radius) discs (m) that are marked occupied
+    :return: (free, resolution, origin) with free[row, col] True for free
+             cells, row 0 at origin y (image flipped like map_server does)
+    """
+    with open(yaml_path) as f:
+        meta = yaml.safe_load(f)
+    image = np.asarray(Image.open(os.path.join(os.path.dirname(yaml_path), meta['image'])).convert('L'), dtype=np.float64)
+    occupancy = image/255.0 if meta.get('negate', 0) else (255.0 - image)/255.0
+    # unknown cells (between the thresholds) are walls as well
+    free = (occupancy < meta.get('free_thresh', 0.196))[::-1]
+    resolution, origin = float(meta['resolution']), np.array(meta['origin'][:2], dtype=np.float64)
+    if len(obstacles):
+        ys, xs = np.ogrid[:free.shape[0], :free.shape[1]]
+        for x, y, radius in obstacles:
+            cx, cy, r = (x - origin[0])/resolution, (y - origin[1])/resolution, radius/resolution
+            free &= (xs + 0.5 - cx)**2 + (ys + 0.5 - cy)**2 > r*r
+    return free, resolution, origin
+
+
+class MapRaycaster:
+    """
+    scans() of `beams` rays over `fov` rad centered on the heading, like the
+    f1tenth gym scan (angle_increment = fov/(beams - 1)). Ranges are cut at
+    max_range; rays leaving the map return max_range. noise adds Gaussian
+    range noise (m), obstacles are (x, y, radius) discs added to the map.
+    """
+    def __init__(self, yaml_path, beams=1080, fov=4.7, max_range=30.0, noise=0.0, seed=0, obstacles=()):
+        free, self.resolution, self.origin = load_map(yaml_path, obstacles)
+        self.height, self.width = free.shape
+        self.dist = (distance_transform_edt(free)*self.resolution).astype(np.float32).ravel()
+        # the same in cells, with the map border as a ring of -1
+        cells = (self.dist/self.resolution).reshape(self.height, self.width)
+        cells[[0, -1], :] = -1
+        cells[:, [0, -1]] = -1
+        self._cells = cells.ravel()
+
+        self.beams = beams
+        self.max_range = max_range
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.angle_min = -fov/2
+        self.angle_increment = fov/(beams - 1)
+        self.angles = self.angle_min + np.arange(beams)*self.angle_increment
+
+    def clearance(self, x, y):
+        """Distance (m) from (x, y) to the nearest wall, 0 off the map."""
+        col = np.floor((np.asarray(x) - self.origin[0])/self.resolution).astype(np.int64)
+        row = np.floor((np.asarray(y) - self.origin[1])/self.resolution).astype(np.int64)
+        inside = (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+        return np.where(inside, self.dist[np.where(inside, row*self.width + col, 0)], 0.0)
+
+    def scan(self, x, y, theta):
+        return self.scans(np.array([[x, y, theta]]))[0]
+
+    def scans(self, poses, chunk=128):
+        """
+        :param poses: (n, 3) x, y, theta, traced `chunk` poses at a time
+        :return: (n, beams) float32 ranges
+        """
+        poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+        ranges = np.empty((len(poses), self.beams), dtype=np.float32)
+        for k in range(0, len(poses), chunk):
+            ranges[k:k + chunk] = self._trace(poses[k:k + chunk])
+        if self.noise:
+            ranges += self.rng.normal(0, self.noise, ranges.shape).astype(np.float32)
+        return ranges
+
+    def _trace(self, poses):
+        angle = (poses[:, 2:3] + self.angles).ravel()
+        dx = np.cos(angle).astype(np.float32)
+        dy = np.sin(angle).astype(np.float32)
+        # ray origins in cells, steps are taken in cells as well
+        x0 = np.repeat(((poses[:, 0] - self.origin[0])/self.resolution).astype(np.float32), self.beams)
+        y0 = np.repeat(((poses[:, 1] - self.origin[1])/self.resolution).astype(np.float32), self.beams)
+
+        max_t = np.float32(self.max_range/self.resolution)
+        ranges = np.full(len(angle), max_t, dtype=np.float32)
+        active = np.arange(len(angle))
+        t = np.zeros(len(angle), dtype=np.float32)
+        dist = self._cells
+        width, col_max, row_max = self.width, np.uint32(self.width - 1), np.uint32(self.height - 1)
+
+        while len(active):
+            # cells off the map (negative ones wrap around as unsigned) are
+            # clamped onto the border ring, which is -1
+            col = np.minimum((x0 + t*dx).astype(np.int32).view(np.uint32), col_max)
+            row = np.minimum((y0 + t*dy).astype(np.int32).view(np.uint32), row_max)
+            d = dist[row*width + col]
+
+            hit = d == 0
+            ranges[active[hit]] = t[hit]
+            keep = (d > 0) & (t < max_t)
+            active = active[keep]
+            x0, y0, dx, dy, d = x0[keep], y0[keep], dx[keep], dy[keep], d[keep]
+            # d is measured between cell centers, stay half a cell diagonal
+            # short of it and take at least half a cell
+            t = t[keep] + np.maximum(d - 0.71, 0.5)
+
+        return (np.minimum(ranges, max_t)*np.float32(self.resolution)).reshape(len(poses), self.beams)
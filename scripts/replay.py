@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline replay of scan/odom sequences through the planners, without ROS.
+
+    python replay.py                              # synthetic sequence, every planner
+    python replay.py fgm_gnu odg_pf_pp -n 2000
+    python replay.py --map ../map/vegas_test.yaml --wpt ../map/wp_vegas_test.csv
+    python replay.py --save seq.npz               # keep the synthetic sequence
+    python replay.py --input seq.npz              # replay a recorded one
+
+Each planner runs its own loop threads on top of ros_stub. A frame (odom,
+then scan) is delivered as soon as the drive command of the previous frame
+was published, so the replay runs as fast as the planner. The latency of a
+cycle is the time from delivering the frame to its drive command.
+
+Sequences are .npz files with ranges (frames x beams), pose (frames x 3:
+x, y, theta), speed (frames) and the angle_min / angle_increment of the scans.
+"""
+import argparse
+import contextlib
+import io
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import ros_stub
+from raycast import MapRaycaster
+from waypoints import load_waypoints
+
+rospy = ros_stub.install()
+
+MAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "map")
+
+# module, planner class (None for the threaded _pp pipelines)
+PLANNERS = {
+    'fgm_gnu': ('fgm_gnu', 'FGM'),
+    'fgm_stech': ('fgm_stech', 'FGM'),
+    'odg_pf': ('odg_pf', 'ODGPF'),
+    'fgm_pp': ('fgm_pp', None),
+    'odg_pf_pp': ('odg_pf_pp', None),
+}
+
+# the scan trigger would hold every loop to `rate`, the budget keeps its usual 10 ms;
+# the _pp drive loops publish every new command instead of at a fixed rate
+DEFAULT_PARAMS = {
+    'rate': 1000000,
+    'drive_rate': 0,
+    'cycle_budget': 0.01,
+    'logging': False,
+}
+
+
+def track_poses(wpt_path, frames, stride=4):
+    """Poses every `stride` waypoints along the track, with the track heading."""
+    waypoints = load_waypoints(wpt_path)
+    idx = (np.arange(frames)*stride) % len(waypoints)
+    return np.column_stack((waypoints['x'][idx], waypoints['y'][idx], waypoints['heading'][idx]))
+
+
+def synthetic_sequence(wpt_path, frames, beams=1080, stride=4, speed=3.0, seed=0):
+    """Track poses with corridor scans (1.5 m to each side) and a few random obstacles ahead."""
+    pose = track_poses(wpt_path, frames, stride)
+
+    rng = np.random.default_rng(seed)
+    angle_min, angle_increment = -2.35, 4.7/beams
+    angle = angle_min + np.arange(beams)*angle_increment
+    corridor = np.minimum(1.5/np.maximum(np.fabs(np.sin(angle)), 1e-3), 10.0)
+    ranges = np.tile(corridor.astype(np.float32), (frames, 1))
+    ranges += rng.normal(0, 0.01, ranges.shape).astype(np.float32)
+    for k in range(frames):
+        for _ in range(rng.integers(0, 3)):
+            s = rng.integers(beams*3//8, beams*5//8)
+            ranges[k, s:s + beams//60] = rng.uniform(0.8, 3.0)
+    return {'ranges': ranges, 'pose': pose, 'speed': np.full(frames, speed),
+            'angle_min': angle_min, 'angle_increment': angle_increment}
+
+
+def map_sequence(yaml_path, wpt_path, frames, stride=4, speed=3.0, noise=0.01):
+    """Track poses with scans raycast over the map."""
+    caster = MapRaycaster(yaml_path, noise=noise)
+    pose = track_poses(wpt_path, frames, stride)
+    return {'ranges': caster.scans(pose), 'pose': pose, 'speed': np.full(frames, speed),
+            'angle_min': caster.angle_min, 'angle_increment': caster.angle_increment}
+
+
+def load_sequence(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def save_sequence(path, seq):
+    np.savez(path, **seq)
+
+
+def scan_msg(ranges, angle_min, angle_increment):
+    msg = ros_stub.Msg()
+    msg.header.stamp = rospy.Time.now()
+    msg.angle_min = angle_min
+    msg.angle_max = angle_min + (len(ranges) - 1)*angle_increment
+    msg.angle_increment = angle_increment
+    msg.ranges = ranges
+    return msg
+
+
+def odom_msg(pose, speed, yaw_rate=0.0):
+    msg = ros_stub.Msg()
+    msg.header.stamp = rospy.Time.now()
+    p = msg.pose.pose
+    p.position.x, p.position.y = float(pose[0]), float(pose[1])
+    p.orientation.x, p.orientation.y = 0.0, 0.0
+    p.orientation.z, p.orientation.w = math.sin(pose[2]/2), math.cos(pose[2]/2)
+    msg.twist.twist.linear.x = float(speed)
+    msg.twist.twist.angular.z = float(yaw_rate)
+    return msg
+
+
+def start_planner(name):
+    """:return: the started loop threads of the planner"""
+    module_name, class_name = PLANNERS[name]
+    module = __import__(module_name)
+    if class_name is None:
+        threads = module.build_pipeline()[0]
+    else:
+        planner = getattr(module, class_name)()
+        threads = (threading.Thread(target=planner.driving, name=name),)
+    for t in threads:
+        t.daemon = True
+        t.start()
+    return threads
+
+
+class PlannerSession:
+    """
+    One planner running on ros_stub, fed one frame at a time.
+
+        with PlannerSession('fgm_gnu', params) as planner:
+            command, latency = planner.step(pose, speed, ranges, angle_min, angle_increment)
+    """
+    def __init__(self, name, params=None, timeout=1.0):
+        ros_stub.reset({**DEFAULT_PARAMS, **(params or {})})
+        self.timeout = timeout
+        self.scan_topic = rospy.get_param('scan_topic', '/scan')
+        self.odom_topic = rospy.get_param('odom_topic', '/odom')
+
+        self.published = threading.Event()
+        self.command = (0.0, 0.0)
+        ros_stub.listen(rospy.get_param('drive_topic', '/drive'), self.on_drive)
+        self.threads = start_planner(name)
+
+    def on_drive(self, msg):
+        self.command = (msg.drive.speed, msg.drive.steering_angle)
+        self.published.set()
+
+    def step(self, pose, speed, ranges, angle_min, angle_increment, yaw_rate=0.0):
+        """
+        Delivers odom, then the scan and waits for the drive command.
+
+        :return: ((speed, steer), latency in s), (None, NaN) after the timeout
+        """
+        self.published.clear()
+        t0 = time.perf_counter()
+        ros_stub.deliver(self.odom_topic, odom_msg(pose, speed, yaw_rate))
+        ros_stub.deliver(self.scan_topic, scan_msg(ranges, angle_min, angle_increment))
+        if self.published.wait(self.timeout):
+            return self.command, time.perf_counter() - t0
+        return None, float('nan')
+
+    def close(self):
+        rospy.signal_shutdown("session done")
+        for t in self.threads:
+            t.join(self.timeout + 1.0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def replay(name, seq, params=None, timeout=1.0):
+    """
+    Replays seq through one planner.
+
+    :return: dict with the per-frame latency (s, NaN for frames without a
+             command), the commands (speed, steer) and the cycles/s
+    """
+    frames = len(seq['ranges'])
+    latency = np.full(frames, np.nan)
+    commands = np.full((frames, 2), np.nan)
+    ranges = np.asarray(seq['ranges'], dtype=np.float32)
+    angle_min, angle_increment = float(seq['angle_min']), float(seq['angle_increment'])
+
+    with PlannerSession(name, params, timeout) as planner:
+        t_start = time.perf_counter()
+        for k in range(frames):
+            command, latency[k] = planner.step(seq['pose'][k], seq['speed'][k], ranges[k], angle_min, angle_increment)
+            if command is not None:
+                commands[k] = command
+        elapsed = time.perf_counter() - t_start
+    return {'latency': latency, 'commands': commands, 'cycles_per_s': frames/elapsed}
+
+
+def summary(name, result):
+    latency = result['latency']
+    done = latency[~np.isnan(latency)]*1e6
+    if len(done) == 0:
+        return f"{name:<10} {len(latency):>7} {len(latency):>7}"
+    p50, p95, p99 = np.percentile(done, (50, 95, 99))
+    return (f"{name:<10} {len(latency):>7} {len(latency) - len(done):>7} {result['cycles_per_s']:>9.0f} "
+            f"{done.mean():>9.1f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {done.max():>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('planners', nargs='*', help=', '.join(PLANNERS))
+    parser.add_argument('--input', help="recorded .npz sequence")
+    parser.add_argument('--save', help="write the replayed sequence to this .npz")
+    parser.add_argument('-n', '--frames', type=int, default=1000, help="frames of the synthetic sequence")
+    parser.add_argument('--wpt', default=os.path.join(MAP_DIR, "wp_vegas.csv"))
+    parser.add_argument('--map', help="map yaml to raycast the scans in, instead of corridor scans")
+    parser.add_argument('--out', help="directory for the planners' time data (default: a temporary one)")
+    parser.add_argument('--timeout', type=float, default=1.0, help="seconds to wait for a command")
+    parser.add_argument('--verbose', action='store_true', help="show the planners' own output")
+    parser.add_argument('--processes', action='store_true', help="run the _pp planners as processes (pp_processes)")
+    args = parser.parse_args()
+
+    if args.input:
+        seq = load_sequence(args.input)
+    elif args.map:
+        seq = map_sequence(args.map, args.wpt, args.frames)
+    else:
+        seq = synthetic_sequence(args.wpt, args.frames)
+    if args.save:
+        save_sequence(args.save, seq)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out = args.out or tmp
+        params = {'time_data_path': out, 'wpt_path': args.wpt, 'pp_processes': args.processes,
+                  'trj_path': os.path.join(out, "trajectory.csv"), 'recording_path': os.path.join(out, "recording.csv")}
+
+        print(f"{len(seq['ranges'])} frames of {seq['ranges'].shape[1]} beams")
+        print(f"{'planner':<10} {'frames':>7} {'missed':>7} {'cycles/s':>9} {'mean[us]':>9} {'p50[us]':>9} {'p95[us]':>9} {'p99[us]':>9} {'max[us]':>9}")
+        for name in args.planners or PLANNERS:
+            if name not in PLANNERS:
+                parser.error(f"unknown planner {name}")
+            output = io.StringIO()
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+                result = replay(name, seq, params, args.timeout)
+            print(summary(name, result))
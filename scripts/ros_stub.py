@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ROS-free stand-ins for rospy and the message packages the planners import,
+to run them offline (replay.py).
+
+    import ros_stub
+    ros_stub.install({'time_data_path': out_dir})
+    import fgm_gnu
+
+install() puts the stubs into sys.modules, so it has to run before the first
+planner import. Messages are attribute trees that grow on first access
+(marker.pose.position.x = ...). Subscribers register their callback under
+the topic and deliver() calls them; publishers count the messages and hand
+them to the listen() callbacks of the topic. Rate.sleep() returns at once.
+"""
+import sys
+import threading
+import time
+import types
+
+_MISSING = object()
+
+params = {}
+_subscribers = {}
+_listeners = {}
+_shutdown = threading.Event()
+
+
+class Msg:
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = Msg()
+        setattr(self, name, value)
+        return value
+
+
+class Marker(Msg):
+    CUBE = 1
+    ADD = 0
+
+
+class Time:
+    __slots__ = ('secs',)
+
+    def __init__(self, secs=0.0):
+        self.secs = float(secs)
+
+    def to_sec(self):
+        return self.secs
+
+    def __eq__(self, other):
+        return isinstance(other, Time) and other.secs == self.secs
+
+    def __hash__(self):
+        return hash(self.secs)
+
+    @classmethod
+    def now(cls):
+        return cls(time.time())
+
+
+class Publisher:
+    def __init__(self, topic, msg_class=None, queue_size=None, **kwargs):
+        self.topic = topic
+        self.count = 0
+        self.last = None
+
+    def publish(self, msg):
+        self.count += 1
+        self.last = msg
+        for callback in _listeners.get(self.topic, ()):
+            callback(msg)
+
+
+class Subscriber:
+    def __init__(self, topic, msg_class=None, callback=None, queue_size=None, **kwargs):
+        self.topic = topic
+        _subscribers.setdefault(topic, []).append(callback)
+
+
+class Rate:
+    def __init__(self, hz):
+        self.hz = hz
+
+    def sleep(self):
+        pass
+
+
+def get_param(name, default=_MISSING):
+    if name in params:
+        return params[name]
+    if default is _MISSING:
+        raise KeyError(name)
+    return default
+
+
+def is_shutdown():
+    return _shutdown.is_set()
+
+
+def signal_shutdown(reason=''):
+    _shutdown.set()
+
+
+def spin():
+    _shutdown.wait()
+
+
+def init_node(name, **kwargs):
+    pass
+
+
+class _log:
+    # a class, not a closure, so that it pickles into the planner processes
+    def __init__(self, level):
+        self.level = level
+
+    def __call__(self, msg, *args):
+        print(f"[{self.level}] {msg % args if args else msg}")
+
+
+def deliver(topic, msg):
+    """Call the subscriber callbacks of topic with msg in this thread."""
+    for callback in _subscribers.get(topic, ()):
+        callback(msg)
+
+
+def listen(topic, callback):
+    """Call callback(msg) for every message published on topic."""
+    _listeners.setdefault(topic, []).append(callback)
+
+
+def reset(new_params=None):
+    """Forget subscribers, listeners and the shutdown flag, params become new_params."""
+    _subscribers.clear()
+    _listeners.clear()
+    _shutdown.clear()
+    params.clear()
+    params.update(new_params or {})
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _messages(package, *names, **classes):
+    for name in names:
+        classes[name] = type(name, (Msg,), {})
+    msg = _module(package + ".msg", **classes)
+    _module(package, msg=msg)
+
+
+def install(new_params=None):
+    """:return: the stub rospy module"""
+    if 'rospy' not in sys.modules or not getattr(sys.modules['rospy'], 'IS_STUB', False):
+        numpy_msg = _module("rospy.numpy_msg", numpy_msg=lambda msg_class: msg_class)
+        _module("rospy", IS_STUB=True, numpy_msg=numpy_msg,
+                Time=Time, Publisher=Publisher, Subscriber=Subscriber, Rate=Rate,
+                get_param=get_param, is_shutdown=is_shutdown, signal_shutdown=signal_shutdown,
+                spin=spin, init_node=init_node,
+                loginfo=_log("INFO"), logwarn=_log("WARN"), logerr=_log("ERROR"))
+        _messages("sensor_msgs", "LaserScan")
+        _messages("nav_msgs", "Odometry")
+        _messages("ackermann_msgs", "AckermannDriveStamped")
+        _messages("visualization_msgs", "MarkerArray", Marker=Marker)
+        _messages("f1tenth_gym_ros", "RaceInfo")
+    reset(new_params)
+    return sys.modules['rospy']
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binary run records: a fixed-size header followed by RECORD_DTYPE records
+(LATENCY_DTYPE for the *_latency.rec streams), the header names the layout.
+
+Records are appended as raw bytes during the run and read back as a
+memory-mapped structured array, so each field is a typed column
+(record['exe_time'], record['x'], ...). Times are float64, the commanded
+speed, steer and pose float32. A record cut off by a crash is ignored.
+
+    python run_record.py ../record     # convert every *_time_data*.csv below it
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+
+import numpy as np
+
+MAGIC = b"LPGREC1\n"
+HEADER_SIZE = 256
+TAGS = ('', 'gp', 'lp')
+TAG_CODE = {tag: code for code, tag in enumerate(TAGS)}
+
+RECORD_DTYPE = np.dtype([
+    ('index', '<i4'),
+    ('time', '<f8'),
+    ('exe_time', '<f8'),
+    ('tag', 'u1'),
+    ('speed', '<f4'),
+    ('steer', '<f4'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('theta', '<f4'),
+])
+
+# one record per published command, stamps and ages in seconds of ROS time
+LATENCY_DTYPE = np.dtype([
+    ('index', '<i4'),
+    ('tag', 'u1'),
+    ('scan_stamp', '<f8'),
+    ('odom_stamp', '<f8'),
+    ('scan_age', '<f8'),
+    ('latency', '<f8'),
+])
+
+
+def _header(dtype):
+    meta = json.dumps({'descr': dtype.descr, 'tags': TAGS}).encode()
+    header = MAGIC + meta
+    if len(header) >= HEADER_SIZE:
+        raise ValueError("record header too long")
+    return header + b" "*(HEADER_SIZE - len(header) - 1) + b"\n"
+
+
+class RunWriter:
+    """Appends arrays of one record dtype to a new record file."""
+    def __init__(self, path, dtype=RECORD_DTYPE):
+        self.path = path
+        self.dtype = dtype
+        self.file = open(path, "wb")
+        self.file.write(_header(dtype))
+        self.count = 0
+
+    def append(self, records):
+        self.file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+        self.count += len(records)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load(path, mode='r', dtype=RECORD_DTYPE):
+    """
+    :param dtype: expected record layout, None takes the one of the file
+    :return: array memory-mapped over the records of path
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise IOError(f"{path} is not a run record")
+    meta = json.loads(header[len(MAGIC):].decode())
+    file_dtype = np.dtype([tuple(field) for field in meta['descr']])
+    if dtype is not None and file_dtype != dtype:
+        raise IOError(f"{path} has an unknown record layout")
+
+    count = (os.path.getsize(path) - HEADER_SIZE)//file_dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=file_dtype)
+    return np.memmap(path, dtype=file_dtype, mode=mode, offset=HEADER_SIZE, shape=(count,))
+
+
+def tag_names(records):
+    return np.array(TAGS)[records['tag']]
+
+
+def from_csv(csv_path):
+    """
+    Time data CSV rows (index, time, exe_time[, tag]) as records, the columns
+    the CSV does not have are NaN. Header rows and rows torn by concurrent
+    writers (old _pp logs) are skipped.
+    """
+    rows = []
+    with open(csv_path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            try:
+                rows.append((int(row[0]), float(row[1]), float(row[2]), TAG_CODE.get(row[3] if len(row) > 3 else '', 0)))
+            except ValueError:
+                continue
+
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    for name in ('speed', 'steer', 'x', 'y', 'theta'):
+        records[name] = np.nan
+    if rows:
+        index, time, exe_time, tag = zip(*rows)
+        records['index'] = index
+        records['time'] = time
+        records['exe_time'] = exe_time
+        records['tag'] = tag
+    return records
+
+
+def convert(csv_path, out_path=None):
+    """:return: path of the record written next to csv_path"""
+    if out_path is None:
+        out_path = os.path.splitext(csv_path)[0] + ".rec"
+    writer = RunWriter(out_path)
+    writer.append(from_csv(csv_path))
+    writer.close()
+    return out_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', help="directory searched for *_time_data*.csv")
+    args = parser.parse_args()
+
+    for csv_path in sorted(glob.glob(os.path.join(args.root, "**", "*_time_data*.csv"), recursive=True)):
+        out_path = convert(csv_path)
+        print(f"{csv_path} -> {out_path} ({len(load(out_path))} records)")
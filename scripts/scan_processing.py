@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+
+
+class ScanFilter:
+    """
+    LaserScan preprocessing shared by every planner.
+
+    process() ingests msg.ranges, fills zero returns from their neighbours and
+    inflates obstacles at range disparities by ROBOT_SCALE (the "bubble" filter).
+
+    exact=True reproduces the original per-beam loops bit for bit:
+        - a zero beam becomes the mean of the non-zero beams within
+          +-fill_window, where beams on its left are already filled
+        - an extension stops at the first beam that is already closer
+    exact=False uses the plain vectorized versions:
+        - zero runs are linearly interpolated between valid beams
+        - every disparity is extended over the full bubble width (running min)
+
+    fill_filtered=False keeps the raw zeros in scan_filtered, as
+    Obstacle_detect.subCallback_od (obstacle_detect.py) needs.
+    """
+    def __init__(self, robot_scale, filter_scale, fill_window=20, exact=True, fill_filtered=True):
+        self.ROBOT_SCALE = robot_scale
+        self.FILTER_SCALE = filter_scale
+        self.fill_window = fill_window
+        self.exact = exact
+        self.fill_filtered = fill_filtered
+
+    def ingest(self, ranges):
+        # Raw bytes are viewed in place like the np.frombuffer view numpy_msg
+        # hands over, then copied once to float64 on purpose: the zero fill
+        # works in place (the message buffer may be read-only) and the exact
+        # path stays bit-identical to the float64 loops it replaced.
+        if isinstance(ranges, (bytes, bytearray, memoryview)):
+            ranges = np.frombuffer(ranges, dtype=np.float32)
+        return np.array(ranges, dtype=np.float64)
+
+    def process(self, ranges, interval, timer=None):
+        """
+        :param ranges: msg.ranges (ndarray, tuple or raw float32 buffer)
+        :param interval: msg.angle_increment
+        :param timer: StageTimer, times the scan_ingest, zero_fill and bubble stages
+        :return: (scan_origin, scan_filtered) as new float64 arrays
+        """
+        if timer is not None:
+            t = timer.now()
+        scan_origin = self.ingest(ranges)
+        scan_filtered = scan_origin.copy()
+        if timer is not None:
+            t = timer.lap('scan_ingest', t)
+
+        self.fill_zeros(scan_origin)
+        if self.fill_filtered:
+            scan_filtered[:] = scan_origin
+        if timer is not None:
+            t = timer.lap('zero_fill', t)
+
+        self.extend_disparities(scan_origin, scan_filtered, interval)
+        if timer is not None:
+            timer.lap('bubble', t)
+        return scan_origin, scan_filtered
+
+    def fill_zeros(self, scan):
+        zero_idx = np.flatnonzero(scan == 0)
+        if len(zero_idx) == 0:
+            return scan
+        if self.exact:
+            self._fill_zeros_exact(scan, zero_idx)
+        else:
+            valid_idx = np.flatnonzero(scan != 0)
+            if len(valid_idx) != 0:
+                scan[zero_idx] = np.interp(zero_idx, valid_idx, scan[valid_idx])
+        return scan
+
+    def _fill_zeros_exact(self, scan, zero_idx):
+        n = len(scan)
+        s = scan.tolist()
+        for i in zero_idx.tolist():
+            cont = 0
+            total = 0
+            for j in range(1, self.fill_window + 1):
+                if i-j >= 0:
+                    if s[i-j] != 0:
+                        cont += 1
+                        total += s[i-j]
+                if i+j < n:
+                    if s[i+j] != 0:
+                        cont += 1
+                        total += s[i+j]
+            if cont != 0:
+                s[i] = total/cont
+        scan[zero_idx] = np.array(s)[zero_idx]
+
+    def extend_disparities(self, scan_origin, scan_filtered, interval):
+        n = len(scan_origin)
+        near = scan_origin[:-1]
+        far = scan_origin[1:]
+        # scan_filtered <= scan_origin everywhere, so only beams that are a
+        # disparity in scan_origin can ever trigger an extension.
+        rising = near*self.FILTER_SCALE < far
+        falling = ~rising & (near > far*self.FILTER_SCALE)
+        if not (rising.any() or falling.any()):
+            return scan_filtered
+
+        if self.exact:
+            self._extend_exact(scan_origin, scan_filtered, interval, rising, falling)
+            return scan_filtered
+
+        rise_idx = np.flatnonzero(rising)
+        fall_idx = np.flatnonzero(falling)
+        rise_val = scan_origin[rise_idx]
+        fall_val = scan_origin[fall_idx + 1]
+
+        # j < filter_num + 1  ->  j = 1 .. ceil(filter_num + 1) - 1
+        rise_len = self._bubble_width(rise_val, interval, n)
+        fall_len = self._bubble_width(fall_val, interval, n)
+
+        # rising edge: i+1 .. i+len, falling edge: i .. i-len (never beam 0)
+        idx_r, val_r = _expand(rise_idx + 1, rise_len, rise_val, 1)
+        idx_f, val_f = _expand(fall_idx, fall_len + 1, fall_val, -1)
+        idx = np.concatenate((idx_r, idx_f))
+        val = np.concatenate((val_r, val_f))
+        keep = (idx < n) & (idx > 0)
+        np.minimum.at(scan_filtered, idx[keep], val[keep])
+        return scan_filtered
+
+    def _bubble_width(self, value, interval, n):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            width = np.ceil(self.ROBOT_SCALE/(value*interval) + 1) - 1
+        return np.nan_to_num(width, nan=0, posinf=n).clip(0, n).astype(np.int64)
+
+    def _extend_exact(self, scan_origin, scan_filtered, interval, rising, falling):
+        n = len(scan_origin)
+        for i in np.flatnonzero(rising | falling).tolist():
+            if scan_origin[i]*self.FILTER_SCALE < scan_filtered[i+1]:
+                value = float(scan_origin[i])
+                width = _width(self.ROBOT_SCALE, value*interval, n)
+                segment = scan_filtered[i+1:min(i+1+width, n)]
+            elif scan_filtered[i] > scan_origin[i+1]*self.FILTER_SCALE:
+                value = float(scan_origin[i+1])
+                width = _width(self.ROBOT_SCALE, value*interval, n)
+                segment = scan_filtered[max(i-width, 1):i+1][::-1]
+            else:
+                continue
+            # stop at the first beam that is already closer than the edge
+            closer = np.flatnonzero(~(segment > value))
+            stop = closer[0] if len(closer) else len(segment)
+            segment[:stop] = value
+
+
+def _width(robot_scale, unit_length, n):
+    # number of j >= 1 with j < robot_scale/unit_length + 1
+    if unit_length == 0:
+        return n
+    filter_num = robot_scale/unit_length
+    if filter_num != filter_num:
+        return 0
+    return int(min(max(math.ceil(filter_num + 1) - 1, 0), n)) if filter_num < n else n
+
+
+def _expand(start, length, value, step):
+    """Flatten [start, start+step*length) ranges into index/value arrays."""
+    total = int(length.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    offset = np.arange(total) - np.repeat(np.cumsum(length) - length, length)
+    idx = np.repeat(start, length) + step*offset
+    return idx, np.repeat(value, length)
+
+
+def window_average(scan, window=10, stride=3, overhang=2, exact=True):
+    """
+    Average of scan[i:i+window] for i = 0, stride, 2*stride, ...
+
+    Windows may run up to `overhang` beams past the end of the scan, those beams
+    count as 0 (main_drive used window=10, stride=3, overhang=2).
+    exact=True adds the samples in the same order as the old while loop,
+    exact=False takes the O(n) cumulative-sum difference.
+    """
+    scan = np.asarray(scan, dtype=np.float64)
+    n = len(scan)
+    starts = np.arange(0, max(n - window + overhang + 1, 1), stride)
+
+    padded = np.zeros(max(starts[-1] + window, n))
+    padded[:n] = scan
+
+    if exact:
+        total = padded[starts]
+        for j in range(1, window):
+            total += padded[starts + j]
+    else:
+        csum = np.concatenate(([0.0], np.cumsum(padded)))
+        total = csum[starts + window] - csum[starts]
+    return total / window
+
+
+def profile_min(profile):
+    # dmin of main_drive: start from the first window and take any smaller
+    # window average, windows averaging exactly 0 are ignored
+    dmin = profile[0]
+    lower = profile[(profile != 0) & (profile < dmin)]
+    if len(lower) != 0:
+        dmin = lower.min()
+    return float(dmin)
+
+
+CLUSTER_DTYPE = np.dtype([
+    ('start', '<i8'),
+    ('end', '<i8'),
+    ('max_idx', '<i8'),
+    ('max', '<f8'),
+    ('min', '<f8'),
+])
+
+
+def cluster_scan(scan, d_group=1.5, d_pi=0.00628, step=math.radians(0.25)):
+    """
+    Clusters of neighbouring points, walked like Obstacle_detect.obs_dect did:
+    beam i joins the cluster of beam i-1 while the two points are closer than
+    d_group + scan[i]*d_pi. The beam that breaks a cluster belongs to none and
+    the next cluster starts right after it. Beams 0 and n-1 are never used.
+
+    :return: CLUSTER_DTYPE array (start, end inclusive, first max index, max, min)
+    """
+    scan = np.asarray(scan, dtype=np.float64)
+    n = len(scan)
+    if n < 3:
+        return np.zeros(0, dtype=CLUSTER_DTYPE)
+
+    linked = np.empty(n, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        x = scan[1:]*math.sin(step)
+        y = scan[:-1] - scan[1:]*math.cos(step)
+        np.less(np.sqrt(x*x + y*y), d_group + scan[1:]*d_pi, out=linked[1:])
+    # beam 1 always starts the first cluster, beam n-1 always ends the last one
+    linked[:2] = True
+    linked[-1] = False
+
+    # in a run of unlinked beams every other one breaks a cluster, the one
+    # after a break starts the next cluster whether it is linked or not
+    idx = np.arange(n)
+    run_start = np.where(~linked & np.concatenate(([False], linked[:-1])), idx, 0)
+    offset = idx - np.maximum.accumulate(run_start)
+    breaks = np.flatnonzero(~linked & (offset % 2 == 0))
+
+    start = np.concatenate(([1], breaks + 1))
+    end = np.concatenate((breaks - 1, [n - 2]))
+    keep = start < n - 1
+    start, end = start[keep], end[keep]
+    if len(start) == 0:
+        return np.zeros(0, dtype=CLUSTER_DTYPE)
+
+    # end + 1 <= n - 1, the odd segments are the single break beams
+    bounds = np.column_stack((start, end + 1)).ravel()
+    cluster_max = np.maximum.reduceat(scan, bounds)[::2]
+    cluster_min = np.minimum.reduceat(scan, bounds)[::2]
+
+    # first beam of each cluster reaching its max (a NaN beam is always a
+    # cluster of its own and keeps its index)
+    label = np.cumsum(np.bincount(start, minlength=n)) - 1
+    member = (label >= 0) & (idx <= end[label])
+    top = cluster_max[label]
+    hits = np.flatnonzero(member & ((scan == top) | (top != top)))
+    max_idx = hits[np.searchsorted(hits, start)]
+
+    clusters = np.zeros(len(start), dtype=CLUSTER_DTYPE)
+    clusters['start'] = start
+    clusters['end'] = end
+    clusters['max_idx'] = max_idx
+    clusters['max'] = cluster_max
+    clusters['min'] = cluster_min
+    return clusters
+
+
+def cluster_length(scan, clusters, step=math.radians(0.25)):
+    """Distance between the first and the last point of each cluster."""
+    theta = (clusters['end'] - clusters['start'])*step
+    near = scan[clusters['start']]
+    far = scan[clusters['end']]
+    with np.errstate(invalid='ignore'):
+        x = far*np.sin(theta)
+        y = near - far*np.cos(theta)
+        return np.sqrt(x*x + y*y)
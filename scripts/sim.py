@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless closed-loop laps: the planners drive a kinematic bicycle model
+through scans raycast over the map, without ROS or the gym.
+
+    python sim.py                                   # every planner on every scenario
+    python sim.py fgm_gnu odg_pf -s curve vegas_test --laps 2
+    python sim.py -s vegas_obs --out ../record/vegas_obs --logging
+
+Every step of dt = 1/rate s the car pose is raycast and sent to the planner
+as odom + scan (PlannerSession of replay.py), the drive command that comes
+back is applied for dt. The simulated time only advances with the steps, so
+a lap takes as long as the planner's compute and the raycast (about 2 ms a
+scan), a few times faster than real time.
+
+A run ends after `laps` laps (open tracks: 5 m before the last waypoint,
+the maps close them off with a wall the planners brake for), on the first
+collision, when the car made no progress for stall_time s or after max_time
+simulated seconds. The car collides when the rear axle, the middle of the
+car or the front axle come closer than robot_scale/2 to a wall.
+
+The planners read mu from sim_params.yaml for their speed limits, the tires
+of the simulated car grip with tire_mu (default: the gym car's 1.0489).
+"""
+import argparse
+import contextlib
+import io
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+from raycast import MapRaycaster
+from replay import DEFAULT_PARAMS, MAP_DIR, PLANNERS, PlannerSession, ros_stub, rospy
+from waypoints import WaypointIndex, load_waypoints
+
+SIM_PARAMS = os.path.join(MAP_DIR, "..", "sim_params.yaml")
+GYM_TIRE_MU = 1.0489
+# lidar ahead of the rear axle, as mounted on the gym car
+LIDAR_OFFSET = 0.275
+
+# map yaml, waypoints, obstacles (fractions of the track, lateral offset m, radius m)
+SCENARIOS = {
+    'curve': ("curve_map.yaml", "wp_curve.csv", ()),
+    'obstacle_1': ("obs1_map.yaml", "wp_obsmap1.csv", ()),
+    'obstacle_2': ("obs2_mapway.yaml", "wp_obsmap2.csv", ()),
+    'vegas_test': ("vegas_test.yaml", "wp_vegas_test.csv", ()),
+    'vegas_obs': ("vegas_test.yaml", "wp_vegas_test.csv",
+                  ((0.12, 0.3, 0.25), (0.3, -0.3, 0.25), (0.47, 0.3, 0.25), (0.65, -0.3, 0.25), (0.83, 0.3, 0.25))),
+}
+
+
+class Bicycle:
+    """
+    Kinematic bicycle model, pose at the rear axle. Steering is limited in
+    angle and rate like the f1tenth gym car, acceleration and lateral
+    acceleration by the friction mu*g.
+    """
+    def __init__(self, length, max_speed, mu, g=9.81, max_steer=0.4189, max_steer_rate=3.2):
+        self.length = length
+        self.max_speed = max_speed
+        self.max_acc = mu*g
+        self.max_steer = max_steer
+        self.max_steer_rate = max_steer_rate
+        self.reset(0.0, 0.0, 0.0)
+
+    def reset(self, x, y, theta):
+        self.x, self.y, self.theta = x, y, theta
+        self.speed = 0.0
+        self.steer = 0.0
+        self.yaw_rate = 0.0
+
+    def step(self, speed, steer, dt):
+        steer = min(max(steer, -self.max_steer), self.max_steer)
+        d_steer = self.max_steer_rate*dt
+        self.steer += min(max(steer - self.steer, -d_steer), d_steer)
+
+        speed = min(max(speed, 0.0), self.max_speed)
+        d_speed = self.max_acc*dt
+        self.speed += min(max(speed - self.speed, -d_speed), d_speed)
+
+        yaw_rate = self.speed*math.tan(self.steer)/self.length
+        # beyond mu*g of lateral acceleration the tires slide, the car turns no tighter
+        if self.speed > 0 and abs(yaw_rate)*self.speed > self.max_acc:
+            yaw_rate = math.copysign(self.max_acc/self.speed, yaw_rate)
+        self.yaw_rate = yaw_rate
+
+        self.x += self.speed*math.cos(self.theta)*dt
+        self.y += self.speed*math.sin(self.theta)*dt
+        self.theta = (self.theta + yaw_rate*dt + math.pi) % (2*math.pi) - math.pi
+
+    def pose(self):
+        return (self.x, self.y, self.theta)
+
+
+def obstacle_discs(waypoints, obstacles):
+    """(fraction, offset, radius) along the track -> (x, y, radius) discs"""
+    discs = []
+    for fraction, offset, radius in obstacles:
+        k = int(fraction*len(waypoints)) % len(waypoints)
+        heading = waypoints['heading'][k]
+        discs.append((waypoints['x'][k] - offset*math.sin(heading), waypoints['y'][k] + offset*math.cos(heading), radius))
+    return discs
+
+
+def race_info_msg(laps, elapsed, collision):
+    msg = ros_stub.Msg()
+    msg.header.stamp = rospy.Time.now()
+    msg.ego_lap_count = float(laps)
+    msg.ego_elapsed_time = elapsed
+    msg.ego_collision = collision
+    return msg
+
+
+def run(name, scenario, params, laps=1, max_time=120.0, timeout=1.0, caster=None, stall_time=5.0):
+    """
+    Drives one planner through a scenario.
+
+    :return: dict with the lap times (simulated s), collision, progress (laps),
+             simulated and wall time, the per-cycle compute cost (s, NaN
+             without a command) and the count of missing or invalid commands
+    """
+    map_yaml, wpt_csv, obstacles = SCENARIOS[scenario]
+    wpt_path = os.path.join(MAP_DIR, wpt_csv)
+    waypoints = load_waypoints(wpt_path)
+    track = WaypointIndex(waypoints)
+    if caster is None:
+        caster = MapRaycaster(os.path.join(MAP_DIR, map_yaml), obstacles=obstacle_discs(waypoints, obstacles))
+
+    dt = 1.0/params.get('rate', 100)
+    car = Bicycle(params.get('robot_length', 0.3302), params.get('max_speed', 20.0), params.get('tire_mu', GYM_TIRE_MU),
+                  params.get('g', 9.81))
+    car.reset(waypoints['x'][0], waypoints['y'][0], waypoints['heading'][0])
+    radius = params.get('robot_scale', 0.2032)/2
+    axle = np.array((0.0, 0.5, 1.0))*car.length
+
+    # open tracks (start and finish apart) end short of the closing wall
+    closed = track.length - track.s[-1] < 1.0
+    lap_length = track.length if closed else track.s[-1] - 5.0
+    idx, progress, lap_start = 0, 0.0, 0.0
+    best, best_step, stall_steps = 0.0, 0, int(stall_time/dt)
+
+    lap_times, collision, latency = [], False, []
+    last, invalid = (0.0, 0.0), 0
+    steps = int(max_time/dt)
+    angle_min, angle_increment = caster.angle_min, caster.angle_increment
+    # the planners run unthrottled, their budget stays one step
+    planner_params = {**params, 'rate': DEFAULT_PARAMS['rate'], 'cycle_budget': params.get('cycle_budget', dt), 'wpt_path': wpt_path}
+    with PlannerSession(name, planner_params, timeout) as planner:
+        t_start = time.perf_counter()
+        for k in range(steps):
+            sim_time = k*dt
+            ros_stub.deliver("/race_info", race_info_msg(len(lap_times), sim_time, collision))
+            ranges = caster.scan(car.x + LIDAR_OFFSET*math.cos(car.theta), car.y + LIDAR_OFFSET*math.sin(car.theta), car.theta)
+            command, cost = planner.step(car.pose(), car.speed, ranges, angle_min, angle_increment, car.yaw_rate)
+            latency.append(cost)
+            # without a (valid) command the car keeps the last one
+            if command is not None and math.isfinite(command[0]) and math.isfinite(command[1]):
+                last = command
+            else:
+                invalid += 1
+            car.step(last[0], last[1], dt)
+
+            x = car.x + axle*math.cos(car.theta)
+            y = car.y + axle*math.sin(car.theta)
+            if np.any(caster.clearance(x, y) < radius):
+                collision = True
+                break
+
+            new_idx, _ = track.nearest(car.pose(), idx)
+            ds = track.s[new_idx] - track.s[idx]
+            if closed:
+                ds = (ds + track.length/2) % track.length - track.length/2
+            idx, progress = new_idx, progress + ds
+            if progress - lap_start >= lap_length:
+                lap_times.append((k + 1)*dt - sum(lap_times))
+                lap_start = progress
+                if len(lap_times) == laps or not closed:
+                    break
+            if progress > best + 0.1:
+                best, best_step = progress, k
+            elif k - best_step > stall_steps:
+                break
+        wall = time.perf_counter() - t_start
+
+    return {'lap_times': lap_times, 'collision': collision, 'progress': progress/lap_length, 'sim_time': (k + 1)*dt,
+            'wall_time': wall, 'latency': np.array(latency), 'invalid': invalid}
+
+
+def summary(name, scenario, result):
+    latency = result['latency']
+    done = latency[~np.isnan(latency)]*1e6
+    lap = f"{result['lap_times'][0]:.2f}" if result['lap_times'] else "-"
+    p99 = np.percentile(done, 99) if len(done) else float('nan')
+    return (f"{scenario:<11} {name:<10} {lap:>8} {len(result['lap_times']):>5} {'yes' if result['collision'] else 'no':>9} "
+            f"{result['progress']*100:>8.1f} {result['sim_time']/result['wall_time']:>6.1f} "
+            f"{done.mean() if len(done) else float('nan'):>9.1f} {p99:>9.1f} {result['invalid']:>7}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('planners', nargs='*', help=', '.join(PLANNERS))
+    parser.add_argument('-s', '--scenarios', nargs='+', default=list(SCENARIOS), help=', '.join(SCENARIOS))
+    parser.add_argument('--laps', type=int, default=1)
+    parser.add_argument('--max-time', type=float, default=120.0, help="simulated seconds per run")
+    parser.add_argument('--params', default=SIM_PARAMS)
+    parser.add_argument('--tire-mu', type=float, default=GYM_TIRE_MU, help="friction of the simulated car")
+    parser.add_argument('--out', help="directory for the planners' time data (default: a temporary one)")
+    parser.add_argument('--logging', action='store_true', help="let the planners log their trajectory")
+    parser.add_argument('--timeout', type=float, default=1.0, help="seconds to wait for a command")
+    parser.add_argument('--verbose', action='store_true', help="show the planners' own output")
+    args = parser.parse_args()
+
+    with open(args.params) as f:
+        params = yaml.safe_load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out = args.out or tmp
+        params.update({'time_data_path': out, 'logging': args.logging, 'tire_mu': args.tire_mu,
+                       'trj_path': os.path.join(out, "trajectory.csv"), 'recording_path': os.path.join(out, "recording.csv")})
+
+        print(f"{'scenario':<11} {'planner':<10} {'lap[s]':>8} {'laps':>5} {'collision':>9} {'track[%]':>8} {'x real':>6} "
+              f"{'mean[us]':>9} {'p99[us]':>9} {'missed':>7}")
+        for scenario in args.scenarios:
+            if scenario not in SCENARIOS:
+                parser.error(f"unknown scenario {scenario}")
+            map_yaml, wpt_csv, obstacles = SCENARIOS[scenario]
+            caster = MapRaycaster(os.path.join(MAP_DIR, map_yaml),
+                                  obstacles=obstacle_discs(load_waypoints(os.path.join(MAP_DIR, wpt_csv)), obstacles))
+            for name in args.planners or PLANNERS:
+                if name not in PLANNERS:
+                    parser.error(f"unknown planner {name}")
+                output = io.StringIO()
+                with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+                    result = run(name, scenario, params, args.laps, args.max_time, args.timeout, caster)
+                print(summary(name, scenario, result))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Friction-limited speed profile along a waypoint track, an offline stage
+like the .wpt compile: load_speed_profile() builds it once and caches it
+in a .spd file next to the waypoint CSV.
+
+The curvature is taken over `window` m of track, the recorded waypoints are
+too noisy from one to the next. The cornering limit sqrt(mu*g/|k|) is then
+cut by a backward pass (the car has to be able to brake down to every later
+limit) and a forward pass (and to accelerate up to it). Braking and
+acceleration get the grip that cornering leaves of mu*g (friction circle),
+at most max_decel / max_accel. Closed tracks are passed twice around.
+
+The planners do not use it yet: mixed into their scan-based limit it did not
+make the simulated laps any faster (see sim.py).
+
+    python speed_profile.py ../map/wp_vegas_test.csv --mu 0.523
+"""
+import argparse
+import os
+
+import numpy as np
+
+from waypoints import KIND_PROFILE, load_waypoints, read_cache, write_cache
+
+
+def track_curvature(waypoints, window=2.0, closed=True):
+    """Curvature (1/m) at every waypoint, heading change over `window` m."""
+    s = np.array(waypoints['s'])
+    heading = np.unwrap(waypoints['heading'])
+    half = window/2
+    if closed:
+        # one more lap before and after, so the window wraps around
+        length = s[-1] + np.hypot(waypoints['x'][0] - waypoints['x'][-1], waypoints['y'][0] - waypoints['y'][-1])
+        turn = heading[-1] - heading[0] + np.angle(np.exp(1j*(heading[0] - heading[-1])))
+        s_ext = np.concatenate((s - length, s, s + length))
+        heading_ext = np.concatenate((heading - turn, heading, heading + turn))
+        lo, hi = s - half, s + half
+    else:
+        s_ext, heading_ext = s, heading
+        lo, hi = np.maximum(s - half, s[0]), np.minimum(s + half, s[-1])
+    span = np.maximum(hi - lo, 1e-6)
+    return (np.interp(hi, s_ext, heading_ext) - np.interp(lo, s_ext, heading_ext))/span
+
+
+def speed_profile(waypoints, mu, g, max_speed, min_speed=0.0, max_accel=None, max_decel=None, window=2.0, closed=None):
+    """
+    :param waypoints: table from load_waypoints()
+    :param closed: None: closed when the last waypoint is within 1 m of the first
+    :return: speed limit (m/s) at every waypoint
+    """
+    x, y, s = waypoints['x'], waypoints['y'], np.array(waypoints['s'])
+    if closed is None:
+        closed = np.hypot(x[0] - x[-1], y[0] - y[-1]) < 1.0
+    grip = mu*g
+    max_accel = grip if max_accel is None else max_accel
+    max_decel = grip if max_decel is None else max_decel
+
+    curvature = np.fabs(track_curvature(waypoints, window, closed))
+    with np.errstate(divide='ignore'):
+        speed = np.minimum(np.sqrt(grip/curvature), max_speed)
+
+    num = len(speed)
+    ds = np.diff(s)
+    if closed:
+        ds = np.append(ds, np.hypot(x[0] - x[-1], y[0] - y[-1]))
+    laps = 2 if closed else 1
+
+    def longitudinal(v, k, limit):
+        lateral = v*v*k
+        return min(np.sqrt(max(grip*grip - lateral*lateral, 0.0)), limit)
+
+    # backward: v[i] <= sqrt(v[i+1]^2 + 2*a*ds)
+    for n in range(laps*num - 1, 0, -1):
+        i, j = (n - 1) % num, n % num
+        if not closed and j == 0:
+            continue
+        v = speed[j]
+        speed[i] = min(speed[i], np.sqrt(v*v + 2*longitudinal(v, curvature[j], max_decel)*ds[i]))
+    # forward: v[i+1] <= sqrt(v[i]^2 + 2*a*ds)
+    for n in range(laps*num - 1):
+        i, j = n % num, (n + 1) % num
+        if not closed and j == 0:
+            continue
+        v = speed[i]
+        speed[j] = min(speed[j], np.sqrt(v*v + 2*longitudinal(v, curvature[i], max_accel)*ds[i]))
+
+    return np.maximum(speed, min_speed)
+
+
+def profile_path(csv_path, mu, g, max_speed, min_speed, window):
+    """The .spd cache of csv_path, one per set of parameters."""
+    key = f"mu{mu:g}_g{g:g}_v{min_speed:g}-{max_speed:g}_w{window:g}"
+    return f"{os.path.splitext(csv_path)[0]}.{key}.spd"
+
+
+def load_speed_profile(csv_path, mu, g, max_speed, min_speed=0.0, window=2.0, delimiter=',', rebuild=False):
+    """
+    speed_profile() of the waypoints of csv_path, memory-mapped from its .spd
+    cache. The cache is rebuilt whenever the CSV changes.
+    """
+    source_stat = os.stat(csv_path)
+    path = profile_path(csv_path, mu, g, max_speed, min_speed, window)
+    cached = None if rebuild else read_cache(path, KIND_PROFILE, source_stat)
+    if cached is not None:
+        return cached[:, 0]
+
+    speed = speed_profile(load_waypoints(csv_path, delimiter), mu, g, max_speed, min_speed, window=window)
+    try:
+        write_cache(path, speed[:, None], KIND_PROFILE, source_stat)
+    except OSError as e:
+        print(f"speed profile cache not written ({e})")
+    return speed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="friction-limited speed profile of waypoint CSVs")
+    parser.add_argument('csv', nargs='+')
+    parser.add_argument('--mu', type=float, default=0.523)
+    parser.add_argument('--g', type=float, default=9.81)
+    parser.add_argument('--max-speed', type=float, default=20.0)
+    parser.add_argument('--min-speed', type=float, default=1.5)
+    parser.add_argument('--window', type=float, default=2.0, help="curvature window (m)")
+    parser.add_argument('--out', help="write x, y, s, curvature, speed of the (last) track to this csv")
+    args = parser.parse_args()
+
+    for csv_path in args.csv:
+        waypoints = load_waypoints(csv_path)
+        speed = load_speed_profile(csv_path, args.mu, args.g, args.max_speed, args.min_speed, args.window, rebuild=True)
+        ds = np.diff(waypoints['s'])
+        lap = np.sum(ds/(0.5*(speed[1:] + speed[:-1])))
+        print(f"{profile_path(csv_path, args.mu, args.g, args.max_speed, args.min_speed, args.window)}: {len(speed)} waypoints, {waypoints['s'][-1]:.1f} m, speed min {speed.min():.2f} "
+              f"mean {speed.mean():.2f} max {speed.max():.2f} m/s, lap at the profile {lap:.2f} s")
+        if args.out:
+            curvature = track_curvature(waypoints, args.window, np.hypot(waypoints['x'][0] - waypoints['x'][-1],
+                                                                          waypoints['y'][0] - waypoints['y'][-1]) < 1.0)
+            np.savetxt(args.out, np.column_stack((waypoints['x'], waypoints['y'], waypoints['s'], curvature, speed)),
+                       delimiter=',', fmt='%.5f')
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+
+import numpy as np
+
+# log-linear buckets like HdrHistogram: values below 2^(SUB_BITS+1) ns have
+# their own bucket, above that every power of two is split into 2^SUB_BITS
+# buckets (<= 1.6 % relative error)
+SUB_BITS = 6
+MAX_VALUE = (1 << 40) - 1
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def bucket_index(ns):
+    shift = max(ns.bit_length() - SUB_BITS - 1, 0)
+    return (ns >> shift) + (shift << SUB_BITS)
+
+
+BUCKETS = bucket_index(MAX_VALUE) + 1
+_ZEROS = [0]*BUCKETS
+
+
+def bucket_upper(idx):
+    """Largest value (ns) that falls into each bucket of idx."""
+    idx = np.asarray(idx, dtype=np.int64)
+    shift = np.maximum((idx >> SUB_BITS) - 1, 0)
+    return ((idx - (shift << SUB_BITS)) << shift) + (1 << shift) - 1
+
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+        self.cur = [0]*BUCKETS
+        self.prev = [0]*BUCKETS
+        self.total = [0]*BUCKETS
+        self.count = 0
+        self.max = 0
+        self.cur_max = 0
+        self.prev_max = 0
+        self.rotate_at = 0
+
+    def rotate(self, now, half_window):
+        self.cur, self.prev = self.prev, self.cur
+        self.cur[:] = _ZEROS
+        self.prev_max, self.cur_max = self.cur_max, 0
+        self.rotate_at = now + half_window
+
+
+class StageTimer:
+    """
+    Per-stage latency histograms for the planner hot path.
+
+        t = timer.now()
+        ...scan ingest...
+        t = timer.lap('scan', t)
+
+    lap() adds perf_counter_ns() - t to the histogram of the stage and returns
+    the new time stamp for the next stage: a bit_length, two shifts and two
+    list increments. Every stage keeps one histogram since start and a rolling
+    one over the last window/2 .. window seconds (two halves, the older is
+    cleared when the current one is full). Each stage should be timed from
+    one thread only.
+
+    enabled=False turns lap() into a plain return of 0.
+    """
+    def __init__(self, stages, window=10.0, report_period=0, enabled=True):
+        self.enabled = enabled
+        self.half_window = int(window*1e9)//2
+        self.report_period = int(report_period*1e9)
+        self._next_report = time.perf_counter_ns() + self.report_period
+        self._stages = {name: _Stage(name) for name in stages}
+
+    def now(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def lap(self, name, t0):
+        if not self.enabled:
+            return 0
+        now = time.perf_counter_ns()
+        ns = now - t0
+        if ns > MAX_VALUE:
+            ns = MAX_VALUE
+        shift = ns.bit_length() - SUB_BITS - 1
+        idx = (ns >> shift) + (shift << SUB_BITS) if shift > 0 else ns
+
+        stage = self._stages[name]
+        if now >= stage.rotate_at:
+            stage.rotate(now, self.half_window)
+        stage.cur[idx] += 1
+        stage.total[idx] += 1
+        stage.count += 1
+        if ns > stage.cur_max:
+            stage.cur_max = ns
+            if ns > stage.max:
+                stage.max = ns
+        return now
+
+    def quantiles(self, name, rolling=False):
+        """
+        :return: ({quantile: ns}, max ns, count) of the stage, the quantiles
+                 are bucket upper bounds capped at the max
+        """
+        stage = self._stages[name]
+        if rolling:
+            counts = np.array(stage.cur, dtype=np.int64) + np.array(stage.prev, dtype=np.int64)
+            high = max(stage.cur_max, stage.prev_max)
+        else:
+            counts = np.array(stage.total, dtype=np.int64)
+            high = stage.max
+        count = int(counts.sum())
+        if count == 0:
+            return {q: 0 for q in QUANTILES}, 0, 0
+
+        cum = np.cumsum(counts)
+        idx = np.searchsorted(cum, np.ceil(np.array(QUANTILES)*count))
+        values = np.minimum(bucket_upper(idx), high)
+        return dict(zip(QUANTILES, values.tolist())), high, count
+
+    def report(self, rolling=False):
+        lines = [f"{'stage':<14} {'count':>8} {'p50[us]':>9} {'p95[us]':>9} {'p99[us]':>9} {'max[us]':>9}"]
+        for name in self._stages:
+            q, high, count = self.quantiles(name, rolling)
+            lines.append(f"{name:<14} {count:>8} {q[0.5]/1e3:>9.1f} {q[0.95]/1e3:>9.1f} {q[0.99]/1e3:>9.1f} {high/1e3:>9.1f}")
+        return "\n".join(lines)
+
+    def report_due(self):
+        """True once every report_period seconds (never for 0)."""
+        if not self.enabled or self.report_period <= 0:
+            return False
+        now = time.perf_counter_ns()
+        if now < self._next_report:
+            return False
+        self._next_report = now + self.report_period
+        return True
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps of the planners through sim.py on a process pool.
+
+    python sweep.py odg_sweep.yaml                  # results in odg_sweep.csv
+    python sweep.py odg_sweep.yaml -j 4 --results ../record/odg_sweep.csv
+
+The sweep file names the planner, the scenarios and the ROS params to vary:
+
+    planner: odg_pf
+    scenarios: [curve, obstacle_1, vegas_obs]
+    search: random                  # or grid (every combination)
+    trials: 40                      # parameter sets drawn by random search
+    seed: 0
+    laps: 1
+    max_time: 60.0
+    params:
+      gamma: [0.3, 0.5, 1.0]                    # these values
+      threshold: {min: 2.0, max: 4.0, num: 5}   # grid: num values, random: uniform
+      obstacle_exp: [0.125, 0.5]                # the exp(1/8) / exp(1/2) obstacle scaling
+      look_gain: {min: 0.2, max: 0.6, num: 3}
+
+Params the planners read: gap_theta_gain, ref_theta_gain, threshold,
+filter_scale, look (FGM), gamma, obstacle_exp, look_base, look_gain (ODG-PF).
+
+A trial is one parameter set on one scenario, run in a fresh worker process.
+Every finished trial is appended to the results csv right away and trials
+already in it are skipped, so starting an interrupted sweep again resumes it.
+The latency columns are only comparable with no more jobs than cores.
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+import yaml
+
+import sim
+
+METRICS = ('lap_time', 'laps', 'collision', 'progress', 'sim_time', 'mean_us', 'p99_us', 'max_us', 'invalid', 'wall_s')
+
+
+def parameter_sets(space, search='grid', trials=20, seed=0):
+    """
+    :param space: {name: [values] or {min, max, num}}
+    :return: list of {name: value}, the same for the same arguments
+    """
+    names = sorted(space)
+    if search == 'grid':
+        values = []
+        for name in names:
+            axis = space[name]
+            if isinstance(axis, dict):
+                axis = np.linspace(axis['min'], axis['max'], axis.get('num', 3)).tolist()
+            values.append(axis)
+        return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+    if search != 'random':
+        raise ValueError(f"unknown search {search}")
+    rng = np.random.default_rng(seed)
+    sets = []
+    for _ in range(trials):
+        params = {}
+        for name in names:
+            axis = space[name]
+            if isinstance(axis, dict):
+                params[name] = round(float(rng.uniform(axis['min'], axis['max'])), 6)
+            else:
+                params[name] = axis[rng.integers(len(axis))]
+        sets.append(params)
+    return sets
+
+
+def trial_key(planner, scenario, params):
+    return f"{planner}|{scenario}|{json.dumps(params, sort_keys=True)}"
+
+
+def run_trial(trial):
+    """Worker: one sim.run(), :return: (trial, metrics)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        params = {**trial['base'], **trial['params'], 'time_data_path': tmp, 'logging': False,
+                  'trj_path': os.path.join(tmp, "trajectory.csv"), 'recording_path': os.path.join(tmp, "recording.csv")}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            result = sim.run(trial['planner'], trial['scenario'], params, trial['laps'], trial['max_time'])
+
+    latency = result['latency']
+    done = latency[~np.isnan(latency)]*1e6
+    return trial, {
+        'lap_time': round(result['lap_times'][0], 3) if result['lap_times'] else '',
+        'laps': len(result['lap_times']),
+        'collision': int(result['collision']),
+        'progress': round(result['progress'], 4),
+        'sim_time': round(result['sim_time'], 3),
+        'mean_us': round(float(done.mean()), 1) if len(done) else '',
+        'p99_us': round(float(np.percentile(done, 99)), 1) if len(done) else '',
+        'max_us': round(float(done.max()), 1) if len(done) else '',
+        'invalid': result['invalid'],
+        'wall_s': round(result['wall_time'], 2),
+    }
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def ranking(rows):
+    """Parameter sets by collisions, then unfinished scenarios, then total lap time."""
+    sets = {}
+    for row in rows:
+        entry = sets.setdefault(row['params'], {'collisions': 0, 'unfinished': 0, 'lap_time': 0.0, 'p99_us': 0.0, 'runs': 0})
+        entry['runs'] += 1
+        entry['collisions'] += int(row['collision'])
+        if row['lap_time'] == '':
+            entry['unfinished'] += 1
+        else:
+            entry['lap_time'] += float(row['lap_time'])
+        if row['p99_us'] != '':
+            entry['p99_us'] = max(entry['p99_us'], float(row['p99_us']))
+    return sorted(sets.items(), key=lambda item: (item[1]['collisions'], item[1]['unfinished'], item[1]['lap_time']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sweep', help="sweep yaml")
+    parser.add_argument('--results', help="results csv (default: next to the sweep yaml)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--params', default=sim.SIM_PARAMS, help="base params")
+    parser.add_argument('--top', type=int, default=10, help="parameter sets to list at the end")
+    args = parser.parse_args()
+
+    with open(args.sweep) as f:
+        sweep = yaml.safe_load(f)
+    with open(args.params) as f:
+        base = yaml.safe_load(f)
+    base.update(sweep.get('base', {}))
+    base.setdefault('tire_mu', sim.GYM_TIRE_MU)
+
+    planner = sweep['planner']
+    if planner not in sim.PLANNERS:
+        parser.error(f"unknown planner {planner}")
+    scenarios = sweep.get('scenarios', list(sim.SCENARIOS))
+    for scenario in scenarios:
+        if scenario not in sim.SCENARIOS:
+            parser.error(f"unknown scenario {scenario}")
+    space = sweep['params']
+    names = sorted(space)
+    sets = parameter_sets(space, sweep.get('search', 'grid'), sweep.get('trials', 20), sweep.get('seed', 0))
+
+    results = args.results or os.path.splitext(args.sweep)[0] + ".csv"
+    rows = load_results(results)
+    done = {row['key'] for row in rows}
+    trials = []
+    for params in sets:
+        for scenario in scenarios:
+            key = trial_key(planner, scenario, params)
+            if key not in done:
+                done.add(key)
+                trials.append({'key': key, 'planner': planner, 'scenario': scenario, 'params': params, 'base': base,
+                               'laps': sweep.get('laps', 1), 'max_time': sweep.get('max_time', 60.0)})
+    print(f"{len(sets)} parameter sets x {len(scenarios)} scenarios: {len(rows)} trials done, {len(trials)} to run")
+
+    fields = ['key', 'planner', 'scenario', 'params', *names, *METRICS]
+    new_file = not os.path.exists(results)
+    with open(results, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fields, extrasaction='ignore')
+        if new_file:
+            writer.writeheader()
+        # one process per trial, the planner threads and ros_stub state die with it
+        pool = multiprocessing.get_context('fork').Pool(max(args.jobs, 1), maxtasksperchild=1)
+        try:
+            for n, (trial, metrics) in enumerate(pool.imap_unordered(run_trial, trials), 1):
+                row = {'key': trial['key'], 'planner': planner, 'scenario': trial['scenario'],
+                       'params': json.dumps(trial['params'], sort_keys=True), **trial['params'], **metrics}
+                writer.writerow(row)
+                f.flush()
+                rows.append({k: str(v) for k, v in row.items()})
+                print(f"[{n}/{len(trials)}] {trial['scenario']:<11} {row['params']} lap {metrics['lap_time'] or '-'} "
+                      f"collision {metrics['collision']} p99 {metrics['p99_us']} us", file=sys.stderr)
+            pool.close()
+        except KeyboardInterrupt:
+            pool.terminate()
+            print("interrupted, run again to resume", file=sys.stderr)
+        pool.join()
+
+    print(f"{'collisions':>10} {'unfinished':>10} {'lap sum[s]':>10} {'p99[us]':>9}  params")
+    for params, entry in ranking([row for row in rows if row['planner'] == planner])[:args.top]:
+        print(f"{entry['collisions']:>10} {entry['unfinished']:>10} {entry['lap_time']:>10.2f} {entry['p99_us']:>9.1f}  {params}")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import threading
+
+import numpy as np
+
+from run_record import LATENCY_DTYPE, RECORD_DTYPE, TAG_CODE, RunWriter
+
+NAN = float('nan')
+NO_POSE = (NAN, NAN, NAN)
+
+
+class _Ring:
+    """Preallocated records of one producer thread, head/tail count records ever written/read."""
+    def __init__(self, capacity, dtype):
+        self.buf = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def take(self):
+        head, tail = self.head, self.tail
+        if head == tail:
+            return None
+        lo, hi = tail % self.capacity, head % self.capacity
+        if lo < hi:
+            batch = self.buf[lo:hi].copy()
+        else:
+            batch = np.concatenate((self.buf[lo:], self.buf[:hi]))
+        self.tail = head
+        return batch
+
+
+class TimeLogger:
+    """
+    Execution-time recorder running off the control threads.
+
+    log() copies one record into a ring buffer owned by the calling thread
+    and returns; no lock, no formatting, no file access. Each ring has a single
+    producer and the writer thread is its single consumer, so moving head and
+    tail (plain int assignments under the GIL) is enough. A background thread
+    drains all rings every `period` seconds, or early once a ring is half
+    full, and writes the batch in time order.
+
+    Records go to a run_record file (index, time, exe_time, gp/lp tag and the
+    commanded speed, steer and pose). A full ring drops the new record
+    instead of blocking, drops are counted in stats().
+
+    Subclasses change DTYPE and log() to record other streams, batches
+    from several threads are merged in ORDER.
+    """
+    DTYPE = RECORD_DTYPE
+    ORDER = 'time'
+
+    def __init__(self, path, capacity=4096, period=0.5):
+        self.capacity = capacity
+        self.period = period
+        self._rings = []
+        self._register_lock = threading.Lock()
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._closed = False
+
+        self.written = 0
+        self.flushes = 0
+
+        self.writer = RunWriter(path, self.DTYPE)
+
+        self._thread = threading.Thread(target=self._run, name="time_logger", daemon=True)
+        self._thread.start()
+
+    def _ring(self):
+        ring = _Ring(self.capacity, self.DTYPE)
+        with self._register_lock:
+            self._rings = self._rings + [ring]
+        self._local.ring = ring
+        return ring
+
+    def log(self, index, time, exe_time, tag='', speed=NAN, steer=NAN, pose=NO_POSE):
+        self._push((index, time, exe_time, TAG_CODE[tag], speed, steer, pose[0], pose[1], pose[2]))
+
+    def _push(self, record):
+        ring = getattr(self._local, 'ring', None)
+        if ring is None:
+            ring = self._ring()
+        pending = ring.head - ring.tail
+        if pending >= ring.capacity:
+            ring.dropped += 1
+            return
+        ring.buf[ring.head % ring.capacity] = record
+        ring.head += 1
+        if pending + 1 == ring.capacity//2:
+            self._wake.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.period)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        batches = [batch for batch in (ring.take() for ring in self._rings) if batch is not None]
+        if not batches:
+            return
+        batch = np.concatenate(batches) if len(batches) > 1 else batches[0]
+        if len(batches) > 1:
+            batch = batch[np.argsort(batch[self.ORDER], kind='stable')]
+        self._account(batch)
+        self.writer.append(batch)
+        self.writer.flush()
+        self.written += len(batch)
+        self.flushes += 1
+
+    def _account(self, batch):
+        pass
+
+    def close(self):
+        """Stop the writer thread, write what is left and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        self.writer.close()
+
+    def stats(self):
+        dropped = sum(ring.dropped for ring in self._rings)
+        return f"time logger: {self.written} records in {self.flushes} writes, {dropped} dropped"
+
+
+class LatencyLogger(TimeLogger):
+    """
+    Scan-to-command latency stream (LATENCY_DTYPE), one record per published
+    command: the scan and odometry stamps it was computed from, the scan age
+    when the cycle started and the scan age when the command was published.
+    Stamps are rospy.Time, so sim time is used when /use_sim_time is set.
+    """
+    DTYPE = LATENCY_DTYPE
+    ORDER = 'index'
+
+    def __init__(self, path, capacity=4096, period=0.5):
+        super(LatencyLogger, self).__init__(path, capacity, period)
+        self.scan_age_sum = 0.0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def log(self, index, tag, scan_stamp, odom_stamp, decision, published):
+        scan = scan_stamp.to_sec()
+        odom = odom_stamp.to_sec() if odom_stamp is not None else NAN
+        self._push((index, TAG_CODE[tag], scan, odom, decision.to_sec() - scan, published.to_sec() - scan))
+
+    def _account(self, batch):
+        self.scan_age_sum += float(batch['scan_age'].sum())
+        self.latency_sum += float(batch['latency'].sum())
+        self.latency_max = max(self.latency_max, float(batch['latency'].max()))
+
+    def stats(self):
+        count = max(self.written, 1)
+        dropped = sum(ring.dropped for ring in self._rings)
+        return (f"latency: {self.written} commands ({dropped} dropped), scan age {self.scan_age_sum/count*1e3:.2f} ms, "
+                f"scan to drive {self.latency_sum/count*1e3:.2f} ms mean, {self.latency_max*1e3:.2f} ms max")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+
+import numpy as np
+
+from waypoints import KIND_TABLE, cache_path, write_cache
+
+TRAJECTORY_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('theta', '<f8'),
+    ('speed', '<f8'),
+])
+
+
+class TrajectoryRecorder:
+    """
+    trajectory.csv writer for the driving loop.
+
+    record() fills the next row of a preallocated TRAJECTORY_DTYPE chunk;
+    a full chunk is handed to a writer thread and recording goes on in a
+    spare one, so the loop never formats text or touches the file. Rows are
+    written as "time,x,y,theta,speed" like the old per-field writes.
+
+    With binary=True close() also writes the rows as the load_table() cache
+    of the CSV (trajectory.tbl), which trajectory_logger.py then memory-maps
+    instead of parsing the text.
+    """
+    def __init__(self, path, chunk=1024, binary=True):
+        self.path = path
+        self.chunk = chunk
+        self.binary = binary
+        self.file = open(path, 'w')
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        self._free.put(np.zeros(chunk, dtype=TRAJECTORY_DTYPE))
+        self._buf = np.zeros(chunk, dtype=TRAJECTORY_DTYPE)
+        self._fill = 0
+        self._written = []
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="trajectory_recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, time, x, y, theta, speed):
+        self._buf[self._fill] = (time, x, y, theta, speed)
+        self._fill += 1
+        if self._fill == self.chunk:
+            self._handoff()
+
+    def _handoff(self):
+        self._full.put((self._buf, self._fill))
+        try:
+            self._buf = self._free.get_nowait()
+        except queue.Empty:
+            self._buf = np.zeros(self.chunk, dtype=TRAJECTORY_DTYPE)
+        self._fill = 0
+
+    def _run(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                return
+            buf, fill = item
+            rows = buf[:fill].copy()
+            self._free.put(buf)
+            self.file.writelines(f"{t},{x},{y},{theta},{speed}\n" for t, x, y, theta, speed in rows.tolist())
+            self.file.flush()
+            if self.binary:
+                self._written.append(rows)
+
+    def close(self):
+        """Write the rows left, wait for the writer and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._fill:
+            self._handoff()
+        self._full.put(None)
+        self._thread.join()
+        self.file.close()
+
+        if self.binary:
+            rows = np.concatenate(self._written) if self._written else np.zeros(0, dtype=TRAJECTORY_DTYPE)
+            table = rows.view('<f8').reshape(-1, len(TRAJECTORY_DTYPE.names))
+            write_cache(cache_path(self.path, KIND_TABLE), table, KIND_TABLE, os.stat(self.path))
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import struct
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Compiled waypoint / table cache
+#   64 byte header: magic, version, kind, rows, cols, source mtime_ns, source size
+#   followed by rows*cols little-endian float64 values
+CACHE_MAGIC = b'LPGNUWPT'
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct('<8sIIQQqq')
+CACHE_HEADER_SIZE = 64
+KIND_TABLE = 0
+KIND_WAYPOINTS = 1
+KIND_PROFILE = 2
+
+WAYPOINT_DTYPE = np.dtype([
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('heading', '<f8'),
+    ('curvature', '<f8'),
+    ('s', '<f8'),
+])
+
+
+class WaypointIndex:
+    """
+    Closed-loop waypoint track built once at startup.
+
+    Keeps the waypoints in a KD-tree together with the cumulative arc length
+    s[i] and the heading of the segment i -> i+1, so nearest() and
+    lookahead() never walk the whole track inside a callback.
+    """
+    def __init__(self, waypoints, window=100, chunk=64):
+        """
+        :param waypoints: table from load_waypoints() or an (N, 2+) array
+        """
+        if getattr(waypoints, 'dtype', None) != WAYPOINT_DTYPE:
+            waypoints = track_table(np.asarray(waypoints, dtype=np.float64)[:, :2])
+        self.xy = np.column_stack((waypoints['x'], waypoints['y']))
+        self.s = np.array(waypoints['s'])
+        self.heading = np.array(waypoints['heading'])
+        self.num = len(self.xy)
+        self.length = float(self.s[-1] + np.hypot(*(self.xy[0] - self.xy[-1])))
+        self.window = min(window, self.num)
+        self.chunk = min(chunk, self.num)
+
+        self.tree = cKDTree(self.xy)
+        # forward-biased search window around the previous nearest index
+        self._window_offset = np.arange(-(self.window // 4), self.window - self.window // 4)
+        self._chunk_offset = np.arange(self.chunk)
+
+    def point(self, idx):
+        return [self.xy[idx, 0], self.xy[idx, 1], self.heading[idx]]
+
+    def nearest(self, position, hint=None):
+        """
+        :param position: [x, y, ...]
+        :param hint: previous nearest index, searched around first
+        :return: (index, distance)
+        """
+        x, y = position[0], position[1]
+        if hint is not None:
+            idx = (hint + self._window_offset) % self.num
+            d2 = (self.xy[idx, 0] - x)**2 + (self.xy[idx, 1] - y)**2
+            k = int(np.argmin(d2))
+            # a minimum on the window border may continue outside of it
+            if 0 < k < len(idx) - 1 or self.window == self.num:
+                return int(idx[k]), float(np.sqrt(d2[k]))
+
+        distance, idx = self.tree.query((x, y))
+        return int(idx), float(distance)
+
+    def lookahead(self, position, idx, distance):
+        """
+        First waypoint from idx onwards (wrapping around) that is farther than
+        `distance` from position.
+
+        :return: (index, actual distance), (idx, its distance) if there is none
+        """
+        x, y = position[0], position[1]
+        d0 = np.hypot(self.xy[idx, 0] - x, self.xy[idx, 1] - y)
+
+        # |p - wp[k]| <= d0 + arc(idx -> k), so every waypoint closer than
+        # distance - d0 along the track can be skipped with one bisect
+        skip = distance - d0 - 1e-9
+        start = idx
+        if skip > 0:
+            if skip >= self.length:
+                return idx, float(d0)
+            target = self.s[idx] + skip
+            if target >= self.length:
+                target -= self.length
+            start = int(np.searchsorted(self.s, target, side='right')) % self.num
+
+        for offset in range(0, self.num, self.chunk):
+            ks = (start + offset + self._chunk_offset) % self.num
+            d = np.hypot(self.xy[ks, 0] - x, self.xy[ks, 1] - y)
+            hit = np.flatnonzero(d > distance)
+            if len(hit) != 0:
+                return int(ks[hit[0]]), float(d[hit[0]])
+        return idx, float(d0)
+
+
+def track_table(xy):
+    """x, y, heading, curvature and arc length of a closed waypoint loop."""
+    seg = np.roll(xy, -1, axis=0) - xy
+    seg_len = np.hypot(seg[:, 0], seg[:, 1])
+    heading = np.arctan2(seg[:, 1], seg[:, 0])
+
+    # heading change over the mean length of the two adjacent segments
+    turn = np.angle(np.exp(1j*(heading - np.roll(heading, 1))))
+    ds = 0.5*(seg_len + np.roll(seg_len, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        curvature = np.where(ds > 0, turn/ds, 0.0)
+
+    table = np.zeros(len(xy), dtype=WAYPOINT_DTYPE)
+    table['x'] = xy[:, 0]
+    table['y'] = xy[:, 1]
+    table['heading'] = heading
+    table['curvature'] = curvature
+    table['s'] = np.concatenate(([0.0], np.cumsum(seg_len[:-1])))
+    return table
+
+
+def cache_path(csv_path, kind):
+    return os.path.splitext(csv_path)[0] + ('.wpt' if kind == KIND_WAYPOINTS else '.tbl')
+
+
+def write_cache(path, data, kind, source_stat):
+    data = np.ascontiguousarray(data)
+    rows = len(data)
+    cols = len(data.dtype.names) if data.dtype.names else data.shape[1]
+    header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, kind, rows, cols,
+                               source_stat.st_mtime_ns, source_stat.st_size)
+
+    # write next to the target and rename, readers never see half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(CACHE_HEADER_SIZE, b'\0'))
+        f.write(data.astype(data.dtype.newbyteorder('<'), copy=False).tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_cache(path, kind, source_stat=None):
+    """
+    :return: memory-mapped data, or None if the file is missing, from another
+             version/kind or older than source_stat
+    """
+    try:
+        with open(path, 'rb') as f:
+            raw = f.read(CACHE_HEADER.size)
+    except OSError:
+        return None
+    if len(raw) != CACHE_HEADER.size:
+        return None
+
+    magic, version, file_kind, rows, cols, mtime_ns, size = CACHE_HEADER.unpack(raw)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or file_kind != kind:
+        return None
+    if source_stat is not None and (mtime_ns, size) != (source_stat.st_mtime_ns, source_stat.st_size):
+        return None
+    if rows == 0:
+        return None
+
+    if kind == KIND_WAYPOINTS:
+        return np.memmap(path, dtype=WAYPOINT_DTYPE, mode='r', offset=CACHE_HEADER_SIZE, shape=(rows,))
+    return np.memmap(path, dtype='<f8', mode='r', offset=CACHE_HEADER_SIZE, shape=(rows, cols))
+
+
+def _load_cached(csv_path, delimiter, kind, build, rebuild):
+    source_stat = os.stat(csv_path)
+    path = cache_path(csv_path, kind)
+    data = None if rebuild else read_cache(path, kind, source_stat)
+    if data is not None:
+        return data
+
+    data = build(np.genfromtxt(csv_path, delimiter=delimiter, dtype='float', ndmin=2))
+    try:
+        write_cache(path, data, kind, source_stat)
+    except OSError as e:
+        print(f"waypoint cache not written ({e}), using {csv_path} directly")
+        return data
+    return read_cache(path, kind)
+
+
+def load_waypoints(csv_path, delimiter=',', rebuild=False):
+    """
+    Compiled waypoint table (WAYPOINT_DTYPE) of csv_path, memory-mapped from
+    the .wpt file next to it. The cache is rebuilt whenever the CSV changes.
+    """
+    return _load_cached(csv_path, delimiter, KIND_WAYPOINTS, lambda raw: track_table(raw[:, :2]), rebuild)
+
+
+def load_table(csv_path, delimiter=',', rebuild=False):
+    """Any numeric CSV (e.g. trajectory.csv) as a memory-mapped float64 array."""
+    return _load_cached(csv_path, delimiter, KIND_TABLE, lambda raw: raw, rebuild)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="compile waypoint CSVs into .wpt caches")
+    parser.add_argument('csv', nargs='+')
+    parser.add_argument('--delimiter', default=',')
+    args = parser.parse_args()
+
+    for csv_path in args.csv:
+        table = load_waypoints(csv_path, args.delimiter, rebuild=True)
+        print(f"{cache_path(csv_path, KIND_WAYPOINTS)}: {len(table)} waypoints")
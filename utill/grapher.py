@@ -2,8 +2,12 @@ from matplotlib import pyplot as plt
 
 import csv
 import os
+import sys
 import numpy
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import run_record
+
 def readDir(path):
     """
     :param path: Dictionary Path
@@ -14,7 +18,7 @@ def readDir(path):
         file_names = []
         _files = os.listdir(path)
         for file in _files:
-            if 'csv' in file.split('.'):
+            if 'csv' in file.split('.') or 'rec' in file.split('.'):
                 file_names.append(f'{file}')
                 files.append(f'{path}/{file}')
 
@@ -24,6 +28,9 @@ def readDir(path):
         csv_datas = []
 
         for csv_file in files:
+            if csv_file.endswith('.rec'):
+                csv_datas.append(readRecord(csv_file))
+                continue
             csv_lines = []
             f = open(csv_file, 'r')
             rdr = csv.reader(f)
@@ -37,6 +44,16 @@ def readDir(path):
     else:
         raise FileNotFoundError
 
+def readRecord(path):
+    """
+    :param path: run_record file
+    :return: rows like the csv lines, [index, time, exe_time(, tag)]
+    """
+    record = run_record.load(path)
+    tags = run_record.tag_names(record).tolist()
+    rows = zip(record['index'].tolist(), record['time'].tolist(), record['exe_time'].tolist(), tags)
+    return [[i, t, e, tag] if tag else [i, t, e] for i, t, e, tag in rows]
+
 def readTimeData(csv_datas):
     if len(csv_datas) == 0:
         raise IOError
@@ -47,7 +64,9 @@ def readTimeData(csv_datas):
         for csv_rows in csv_data:
             time_data = []
             for string in csv_rows:
-                if len(string.split('.')) > 1:
+                if not isinstance(string, str):
+                    time_d = string
+                elif len(string.split('.')) > 1:
                     time_d = float(string)
                 elif len(string.split('.')) <= 1 and string.isnumeric():
                     time_d = int(string)
@@ -75,7 +94,8 @@ def graphData(data_rows, name):
         t_t = 0
 
         for time_data in data:
-            if len(time_data) < 3:
+            if len(time_data) < 3 or not isinstance(time_data[0], int):
+                # header row
                 continue
             if len(time_data) == 3:
                 # 통합
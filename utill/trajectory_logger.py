@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
 import rospy
 from visualization_msgs.msg import Marker, MarkerArray
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from waypoints import load_waypoints, load_table
+
 class logger:
     def __init__(self):
         wpt_path = rospy.get_param('wpt_path')
         trj_path = rospy.get_param('trj_path')
         wpt_delimeter = rospy.get_param('wpt_delimeter')
-        self.wp = np.genfromtxt(wpt_path, delimiter=wpt_delimeter)
-        self.tr = np.genfromtxt(trj_path, delimiter=wpt_delimeter)
+        wp = load_waypoints(wpt_path, wpt_delimeter)
+        self.wp = np.column_stack((wp['x'], wp['y']))
+        self.tr = load_table(trj_path, wpt_delimeter)
 
-        self.tr = np.array(self.filtering())
+        self.tr = self.filtering()
         
         self.wp_list = self.wp[:,:2]
         self.tr_list = self.tr[:,1:3]
@@ -32,14 +38,9 @@ class logger:
         self.weighted_RMS_k = 1.4**2
     
     def filtering(self):
+        # drop rows whose timestamp repeats in the next row
         tr = self.tr[:,0]
-        filtered_tr = []
-        for i in range(len(self.tr)-1):
-            if tr[i+1] - tr[i] == 0:
-                continue
-            else:
-                filtered_tr.append(self.tr[i,:])
-        return filtered_tr
+        return np.array(self.tr[:-1][np.diff(tr) != 0])
 
     def marking_wp(self):
         for i in range(len(self.wp_list)):